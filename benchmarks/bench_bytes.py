@@ -0,0 +1,61 @@
+"""
+Benchmark for encoding compound documents. Compares dumping a page with an
+increasing number of comments followed by ``json.dumps`` against
+:func:`~compound_jsonapi.schema.Schema.dumps_bytes`, and loading the encoded
+document with ``json.loads`` followed by ``load`` against
+:func:`~compound_jsonapi.schema.Schema.loads_bytes`, using the fastest available
+:mod:`~compound_jsonapi.encoding` backend.
+
+Run with::
+
+    python benchmarks/bench_bytes.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from bench_included import build_page  # noqa: E402
+from conftest import PageSchema, CommentSchema, AuthorSchema, TagSchema  # noqa: E402
+
+from compound_jsonapi import encoding  # noqa: E402
+
+
+def dump_json(schema, page):
+    data, errors = schema.dump(page)
+    return json.dumps(data).encode('utf-8')
+
+
+def dump_bytes(schema, page):
+    data, errors = schema.dumps_bytes(page)
+    return data
+
+
+def load_json(schema, document):
+    data, errors = schema.load(json.loads(document.decode('utf-8')))
+    return data
+
+
+def load_bytes(schema, document):
+    data, errors = schema.loads_bytes(document)
+    return data
+
+
+def main(sizes=(250, 1000, 4000), repeat=3):
+    schema = PageSchema(include_schemas=(PageSchema, CommentSchema, AuthorSchema, TagSchema))
+    print('Encoding backend: {0}'.format(encoding.backend))
+    print('{0:>10} {1:>12} {2:>12} {3:>12} {4:>12}'.format('comments', 'dump+json', 'dumps_bytes',
+                                                           'json+load', 'loads_bytes'))
+    for size in sizes:
+        page = build_page(size)
+        document = dump_bytes(schema, page)
+        timings = [min(timeit.repeat(lambda: func(schema, arg), number=1, repeat=repeat))
+                   for func, arg in [(dump_json, page), (dump_bytes, page),
+                                     (load_json, document), (load_bytes, document)]]
+        print('{0:>10} {1:>12.4f} {2:>12.4f} {3:>12.4f} {4:>12.4f}'.format(size, *timings))
+
+
+if __name__ == '__main__':
+    main()
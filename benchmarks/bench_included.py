@@ -0,0 +1,58 @@
+"""
+Benchmark for the handling of the included resources when dumping a compound
+document. Dumps a page with an increasing number of comments, each of which has
+its own author with a set of interests, and reports the time per included
+resource. With a constant-time visited check the time per included resource
+stays flat as the number of included resources grows.
+
+Run with::
+
+    python benchmarks/bench_included.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from conftest import PageSchema, CommentSchema, AuthorSchema, TagSchema  # noqa: E402
+
+
+def build_page(comment_count, tag_count=3):
+    """Build a page with ``comment_count`` comments, each with a distinct author
+    that has ``tag_count`` distinct interests."""
+    page = {'id': 1,
+            'title': 'Page',
+            'text': 'Text',
+            'author': {'id': 0, 'name': 'Author', 'interests': []},
+            'comments': []}
+    for idx in range(0, comment_count):
+        author = {'id': idx + 1,
+                  'name': 'Author {0}'.format(idx + 1),
+                  'interests': [{'id': idx * tag_count + tag_idx, 'tag': 'Tag'} for tag_idx in range(0, tag_count)]}
+        page['comments'].append({'id': idx,
+                                 'title': 'Comment {0}'.format(idx),
+                                 'text': 'Text',
+                                 'author': author,
+                                 'page': page})
+    return page
+
+
+def dump(page):
+    schema = PageSchema(include_schemas=(CommentSchema, AuthorSchema, TagSchema))
+    data, errors = schema.dump(page)
+    return data
+
+
+def main(sizes=(250, 500, 1000, 2000, 4000), repeat=3):
+    print('{0:>10} {1:>10} {2:>12} {3:>16}'.format('comments', 'included', 'seconds', 'usec / included'))
+    for size in sizes:
+        page = build_page(size)
+        included = len(dump(page)['included'])
+        seconds = min(timeit.repeat(lambda: dump(page), number=1, repeat=repeat))
+        print('{0:>10} {1:>10} {2:>12.4f} {3:>16.2f}'.format(size, included, seconds,
+                                                             seconds / included * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark for loading compound documents with a large number of included
+resources. Loads a page with an increasing number of comments, each of which
+has its own author with a set of interests, and reports the time per included
+resource.
+
+Run with::
+
+    python benchmarks/bench_load.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from conftest import PageSchema, CommentSchema, AuthorSchema, TagSchema  # noqa: E402
+
+
+def build_document(comment_count, tag_count=3):
+    """Build a compound document for a page with ``comment_count`` comments, each
+    with a distinct author that has ``tag_count`` distinct interests."""
+    included = [{'type': 'authors', 'id': '0', 'attributes': {'name': 'Author'}}]
+    comments = []
+    for idx in range(0, comment_count):
+        tags = [{'type': 'tags', 'id': str(idx * tag_count + tag_idx), 'attributes': {'tag': 'Tag'}}
+                for tag_idx in range(0, tag_count)]
+        author = {'type': 'authors',
+                  'id': str(idx + 1),
+                  'attributes': {'name': 'Author {0}'.format(idx + 1)},
+                  'relationships': {'interests': {'data': [{'type': 'tags', 'id': tag['id']} for tag in tags]}}}
+        comment = {'type': 'comments',
+                   'id': str(idx),
+                   'attributes': {'title': 'Comment {0}'.format(idx), 'text': 'Text'},
+                   'relationships': {'author': {'data': {'type': 'authors', 'id': author['id']}},
+                                     'page': {'data': {'type': 'pages', 'id': '1'}}}}
+        included.extend(tags)
+        included.append(author)
+        included.append(comment)
+        comments.append({'type': 'comments', 'id': comment['id']})
+    return {'data': {'type': 'pages',
+                     'id': '1',
+                     'attributes': {'title': 'Page', 'text': 'Text'},
+                     'relationships': {'author': {'data': {'type': 'authors', 'id': '0'}},
+                                       'comments': {'data': comments}}},
+            'included': included}
+
+
+def load(document):
+    schema = PageSchema(include_schemas=(CommentSchema, AuthorSchema, TagSchema))
+    data, errors = schema.load(document)
+    return data
+
+
+def main(sizes=(250, 500, 1000, 2000, 4000), repeat=3):
+    print('{0:>10} {1:>10} {2:>12} {3:>16}'.format('comments', 'included', 'seconds', 'usec / included'))
+    for size in sizes:
+        document = build_document(size)
+        included = len(document['included'])
+        seconds = min(timeit.repeat(lambda: load(document), number=1, repeat=repeat))
+        print('{0:>10} {1:>10} {2:>12.4f} {3:>16.2f}'.format(size, included, seconds,
+                                                             seconds / included * 1000000))
+
+
+if __name__ == '__main__':
+    main()
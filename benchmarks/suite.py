@@ -0,0 +1,194 @@
+"""
+Benchmark suite for dumping and loading compound documents built from
+synthetic object graphs of different shapes, using the Page / Comment / Author
+/ Tag schemas from the tests:
+
+* ``wide``: a single page with many comments, all by the page's author
+* ``deep``: a chain of pages, each with a single comment that links to the
+  next page
+* ``cycle``: a page with many comments by a small pool of authors, which all
+  share the same interests
+* ``many``: a collection of comments as the primary data, each by its own
+  author
+
+For each shape and size, the time to dump and load the document is measured,
+followed by a separate run under :mod:`tracemalloc` that measures the peak
+memory use and the number of memory blocks held by the result. The results are
+written as JSON and can be compared with an earlier run.
+
+Run with::
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --sizes 10 1000 --compare results.json
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+import marshmallow  # noqa: E402
+
+from conftest import PageSchema, CommentSchema, AuthorSchema, TagSchema  # noqa: E402
+
+from compound_jsonapi import encoding  # noqa: E402
+
+INCLUDE_SCHEMAS = (PageSchema, CommentSchema, AuthorSchema, TagSchema)
+
+
+def _author(idx, interests=()):
+    return {'id': idx, 'name': 'Author {0}'.format(idx), 'interests': list(interests)}
+
+
+def _comment(idx, author, page):
+    return {'id': idx, 'title': 'Comment {0}'.format(idx), 'text': 'Text', 'author': author, 'page': page}
+
+
+def _page(idx, author):
+    return {'id': idx, 'title': 'Page {0}'.format(idx), 'text': 'Text', 'author': author, 'comments': []}
+
+
+def build_wide(size):
+    """A single page with ``size - 2`` comments by the page's author."""
+    author = _author(0)
+    page = _page(0, author)
+    page['comments'] = [_comment(idx, author, page) for idx in range(0, max(size - 2, 0))]
+    return PageSchema, page, False
+
+
+def build_deep(size):
+    """A chain of ``size / 2`` pages, each with a comment linking to the next page."""
+    author = _author(0)
+    pages = [_page(idx, author) for idx in range(0, max(size // 2, 1))]
+    for idx, page in enumerate(pages):
+        page['comments'] = [_comment(idx, author, pages[idx + 1] if idx + 1 < len(pages) else page)]
+    return PageSchema, pages[0], False
+
+
+def build_cycle(size):
+    """A page with comments by ``sqrt(size)`` authors that all share the same
+    ``sqrt(size)`` interests."""
+    count = max(int(math.sqrt(size)), 1)
+    tags = [{'id': idx, 'tag': 'Tag {0}'.format(idx)} for idx in range(0, count)]
+    authors = [_author(idx, tags) for idx in range(0, count)]
+    page = _page(0, authors[0])
+    page['comments'] = [_comment(idx, authors[idx % count], page) for idx in range(0, max(size - 2 * count, 1))]
+    return PageSchema, page, False
+
+
+def build_many(size):
+    """``size / 2`` comments on the same page as the primary data, each by its own author."""
+    page = _page(0, _author(0))
+    comments = [_comment(idx, _author(idx + 1), page) for idx in range(0, max(size // 2, 1))]
+    page['comments'] = comments
+    return CommentSchema, comments, True
+
+
+SHAPES = [('wide', build_wide), ('deep', build_deep), ('cycle', build_cycle), ('many', build_many)]
+
+
+def _measure(func, repeat):
+    """Return the fastest time of ``repeat`` calls to ``func`` and its last result."""
+    best = None
+    for _ in range(0, repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def _measure_memory(func):
+    """Return the peak memory in bytes and the number of blocks held by the
+    result of calling ``func``."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+        blocks = sum([stat.count for stat in tracemalloc.take_snapshot().statistics('filename')])
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, blocks
+
+
+def run(shapes, sizes, repeat):
+    """Run the benchmarks for all ``shapes`` and ``sizes``.
+
+    :return: ``list`` of result ``dict``\\ s
+    """
+    results = []
+    for name, build in shapes:
+        for size in sizes:
+            schema_class, obj, many = build(size)
+            schema = schema_class(include_schemas=INCLUDE_SCHEMAS, many=many)
+            document, errors = schema.dump(obj)
+            if errors:
+                raise RuntimeError('Dumping the {0} graph failed: {1}'.format(name, errors))
+            nodes = (len(document['data']) if many else 1) + len(document['included'])
+            for operation, func in [('dump', lambda: schema.dump(obj)),
+                                    ('load', lambda: schema.load(document))]:
+                seconds, _ = _measure(func, repeat)
+                peak, blocks = _measure_memory(func)
+                results.append({'shape': name,
+                                'size': size,
+                                'nodes': nodes,
+                                'operation': operation,
+                                'seconds': seconds,
+                                'nodes_per_second': nodes / seconds if seconds else None,
+                                'peak_bytes': peak,
+                                'blocks': blocks})
+                print('{shape:>6} {size:>8} {nodes:>8} {operation:>5} {seconds:>10.4f} '
+                      '{nodes_per_second:>12.0f} {peak_bytes:>12} {blocks:>10}'.format(**results[-1]))
+    return results
+
+
+def compare(results, baseline):
+    """Print the ratio of each result to the matching result in the ``baseline``."""
+    previous = dict([((result['shape'], result['size'], result['operation']), result)
+                     for result in baseline['results']])
+    print('{0:>6} {1:>8} {2:>5} {3:>10} {4:>10} {5:>10}'.format('shape', 'size', 'op', 'time', 'peak', 'blocks'))
+    for result in results:
+        other = previous.get((result['shape'], result['size'], result['operation']))
+        if other is not None:
+            print('{0:>6} {1:>8} {2:>5} {3:>10.2f} {4:>10.2f} {5:>10.2f}'.format(
+                result['shape'], result['size'], result['operation'],
+                result['seconds'] / other['seconds'] if other['seconds'] else float('nan'),
+                result['peak_bytes'] / other['peak_bytes'] if other['peak_bytes'] else float('nan'),
+                result['blocks'] / other['blocks'] if other['blocks'] else float('nan')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark compound document dumps and loads')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+                        help='The approximate number of nodes per graph')
+    parser.add_argument('--shapes', nargs='+', choices=[name for name, _ in SHAPES],
+                        default=[name for name, _ in SHAPES], help='The graph shapes to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of timed runs per benchmark')
+    parser.add_argument('--output', help='The file to write the JSON results to')
+    parser.add_argument('--compare', help='A JSON results file to compare against')
+    args = parser.parse_args(argv)
+    print('{0:>6} {1:>8} {2:>8} {3:>5} {4:>10} {5:>12} {6:>12} {7:>10}'.format(
+        'shape', 'size', 'nodes', 'op', 'seconds', 'nodes / s', 'peak bytes', 'blocks'))
+    results = run([(name, build) for name, build in SHAPES if name in args.shapes], args.sizes, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as out_f:
+            json.dump({'python': platform.python_version(),
+                       'marshmallow': marshmallow.__version__,
+                       'encoding': encoding.backend,
+                       'results': results}, out_f, indent=2)
+    if args.compare:
+        with open(args.compare) as in_f:
+            compare(results, json.load(in_f))
+
+
+if __name__ == '__main__':
+    main()
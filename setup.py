@@ -27,5 +27,9 @@ setup(name='compound-jsonapi',
       include_package_data=True,
       zip_safe=False,
       install_requires = requires,
+      extras_require={
+        'stream': ['ijson'],
+        'fast': ['orjson'],
+        },
       test_suite='tests',
       )
@@ -0,0 +1,114 @@
+"""
+:mod:`compound_jsonapi.aio`
+===========================
+
+Provides the :mod:`asyncio` implementation of
+:func:`~compound_jsonapi.schema.Schema.dump_async`, for objects whose
+relationship attributes are awaitables, such as the lazy relationships of an
+asynchronous ORM.
+
+The object graph is serialised level by level, as in
+:func:`~compound_jsonapi.schema.Schema.dump`. Before each level is serialised,
+the relationship values of all the objects in that level are resolved
+concurrently with :func:`asyncio.gather`, so that the latency of the awaitables
+overlaps within a level instead of adding up along the graph.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import asyncio
+import inspect
+
+import marshmallow as ma
+
+from timeit import default_timer as timer
+
+from .context import DumpContext
+from .instrumentation import Stats
+
+
+async def _gather_list(values):
+    """Await all awaitables in the ``list`` of ``values``."""
+    return list(await asyncio.gather(*[_value(value) for value in values]))
+
+
+async def _value(value):
+    """Await the ``value`` if it is awaitable."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _resolve(context, items, seen):
+    """Resolve the relationship values of all ``(node, obj)`` ``items`` that link
+    to included types and that have not been ``seen`` yet. Awaitable values, and
+    ``list``\\ s that contain awaitables, are awaited concurrently. The values are
+    stored in the ``context``\\ 's ``resolved`` values. Relationships with a
+    batch ``loader`` are prefetched by the ``context``."""
+    keys = []
+    awaitables = []
+    for node, obj in items:
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        for field_name, field, target in node.relationships:
+            if target.type_ not in context.include_schemas or field.loader is not None:
+                continue
+            value = node.schema.get_attribute(obj, field.attribute or field_name, ma.missing)
+            if inspect.isawaitable(value):
+                keys.append((id(obj), field_name))
+                awaitables.append(value)
+            elif isinstance(value, list) and any([inspect.isawaitable(part) for part in value]):
+                keys.append((id(obj), field_name))
+                awaitables.append(_gather_list(value))
+            else:
+                context.resolved[(id(obj), field_name)] = value
+    if awaitables:
+        for key, value in zip(keys, await asyncio.gather(*awaitables)):
+            context.resolved[key] = value
+
+
+async def dump_async(schema, obj, many=None):
+    """Serialise ``obj`` into a compound JSONAPI document with the root
+    ``schema``, resolving awaitable relationship values level by level. If the
+    ``schema`` has an ``instrumentation``, the timings and counters of the dump
+    are reported to it as for :func:`~compound_jsonapi.schema.Schema.dump`. See
+    :func:`~compound_jsonapi.schema.Schema.dump_async`."""
+    if schema._node is None:
+        schema.compile()
+    obj = await _value(obj)
+    many = schema.many if many is None else bool(many)
+    if many:
+        obj = list(obj)
+    node = schema._node
+    instrumentation = schema.instrumentation
+    context = DumpContext(schema)
+    context.resolved = {}
+    seen = set()
+    if instrumentation is not None:
+        context.stats = Stats()
+        started = timer()
+    with context:
+        for part in obj if many else [obj]:
+            context.visit_root(node, part)
+    context.prefetch([(node, part) for part in (obj if many else [obj])])
+    await _resolve(context, [(node, part) for part in (obj if many else [obj])], seen)
+    with context:
+        result = schema.dump_resources(obj, many=many)
+    if instrumentation is not None:
+        context.stats.time('dump.primary', timer() - started)
+        context.stats.count('dump.resources', len(obj) if many else 1, node.type_)
+    if result.data is not None:
+        while context.pending:
+            await _resolve(context, [(pending_node, pending_obj)
+                                     for pending_node, (objs, _) in context.pending.items()
+                                     for pending_obj in objs], seen)
+            batch = context.dump_next()
+            for key, resource in batch or ():
+                context.registry.include(key, resource)
+        if context.errors:
+            result.errors['included'] = context.errors
+        result.data['included'] = context.registry.included()
+    if instrumentation is not None:
+        context.stats.count('dump.included', len(context.registry.included()))
+        context.stats.report(instrumentation)
+    return result
@@ -0,0 +1,233 @@
+"""
+:mod:`compound_jsonapi.cache`
+=============================
+
+Provides caches for serialised resource objects that are re-used across
+dumps. If a :class:`~compound_jsonapi.cache.ResourceCache` is set as the
+``cache`` of the root :class:`~compound_jsonapi.schema.Schema`, then included
+resources whose :class:`~compound_jsonapi.schema.Schema` defines a
+``Meta.version_attr`` are looked up in the cache before they are serialised
+and the cached resource objects are used directly in the ``included`` list.
+
+Resources are cached by ``(type, id, version, variant)``, where the version is
+read from the ``Meta.version_attr`` attribute (for example ``'updated_at'``
+or an etag) and the variant identifies the
+:class:`~compound_jsonapi.schema.Schema` and its options, so that resources
+serialised with different sparse fieldsets or included types are cached
+separately. Updating an object changes its version, so its stale resource is
+not used again and is evicted eventually.
+
+The :class:`~compound_jsonapi.cache.MemoryCache` caches the resources in the
+current process. The :class:`~compound_jsonapi.cache.StoreCache` caches the
+encoded resources in a shared key-value store, such as memcached or Redis,
+for which :class:`~compound_jsonapi.cache.LocalStore` is an in-process
+stand-in. Both can also invalidate all cached resource objects of a resource
+explicitly.
+
+As cached resource objects are shared between dumps, they must not be
+modified.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+from . import encoding
+
+
+class ResourceCache(object):
+    """Base class for caches of serialised resource objects."""
+
+    def get_many(self, keys):
+        """Return the cached resource objects for the ``keys``.
+
+        :param keys: The ``(type, id, version, variant)`` keys to look up
+        :type keys: ``list``
+        :return: ``list`` with the resource object or ``None`` for each key
+        """
+        raise NotImplementedError()
+
+    def set_many(self, items):
+        """Cache the resource objects.
+
+        :param items: ``(key, resource)`` tuples to cache
+        :type items: ``list``
+        """
+        raise NotImplementedError()
+
+    def invalidate(self, type_, id_):
+        """Remove all cached resource objects for the resource ``type_`` and
+        ``id_``, regardless of their version and variant."""
+        raise NotImplementedError()
+
+    def clear(self):
+        """Remove all cached resource objects."""
+        raise NotImplementedError()
+
+
+class MemoryCache(ResourceCache):
+    """In-process :class:`~compound_jsonapi.cache.ResourceCache` that evicts
+    the least recently used resource objects once it holds ``max_size`` of
+    them, and resource objects that are older than ``ttl`` seconds."""
+
+    def __init__(self, max_size=10000, ttl=None):
+        """
+        :param max_size: The maximum number of resource objects to cache
+        :type max_size: ``int``
+        :param ttl: The time in seconds after which a resource object expires,
+                    or ``None`` if they do not expire
+        :type ttl: ``float``
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        result = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is None:
+                    result.append(None)
+                elif entry[0] is not None and entry[0] < now:
+                    self._unindex(key)
+                    result.append(None)
+                else:
+                    self._entries[key] = entry
+                    result.append(entry[1])
+        return result
+
+    def set_many(self, items):
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for key, resource in items:
+                if self._entries.pop(key, None) is None:
+                    self._index.setdefault(key[:2], set()).add(key)
+                self._entries[key] = (expires, resource)
+            while len(self._entries) > self.max_size:
+                key, _ = self._entries.popitem(last=False)
+                self._unindex(key)
+
+    def invalidate(self, type_, id_):
+        with self._lock:
+            for key in self._index.pop((type_, str(id_)), ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def _unindex(self, key):
+        """Remove the ``key`` from the index by resource."""
+        keys = self._index.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._index[key[:2]]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class StoreCache(ResourceCache):
+    """:class:`~compound_jsonapi.cache.ResourceCache` that stores the encoded
+    resource objects in a shared key-value ``store``. The ``store`` needs to
+    provide ``get_many(keys)``, returning a ``dict`` of the keys that were
+    found, and ``set_many(mapping, ttl)``.
+
+    As the keys in the ``store`` cannot be enumerated, the store key of each
+    resource object includes a generation token that is stored per resource.
+    :func:`~compound_jsonapi.cache.StoreCache.invalidate` replaces the token, so
+    that the resource objects cached under the old token are no longer found
+    and expire from the ``store``. Resource objects are cached under the token
+    that was current when they were looked up, so that a resource that is
+    invalidated while it is being serialised is not cached under the new token.
+    """
+
+    def __init__(self, store, prefix='compound_jsonapi', ttl=None):
+        """
+        :param store: The key-value store, such as a
+                      :class:`~compound_jsonapi.cache.LocalStore`
+        :param prefix: The prefix for all keys
+        :type prefix: ``str``
+        :param ttl: The time in seconds after which a resource object expires
+        :type ttl: ``float``
+        """
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _store_key(self, key, generation):
+        return ':'.join([self.prefix] + [str(part) for part in key] + [generation])
+
+    def _generation_key(self, type_, id_):
+        return ':'.join([self.prefix, 'generation', str(type_), str(id_)])
+
+    def _generations(self, keys):
+        """Return the current generation token of each resource in the ``keys``,
+        by ``(type, id)``."""
+        generation_keys = dict([(key[:2], self._generation_key(*key[:2])) for key in keys])
+        found = self.store.get_many(list(set(generation_keys.values())))
+        return dict([(resource, encoding.loads(found[generation_key]) if generation_key in found else '0')
+                     for resource, generation_key in generation_keys.items()])
+
+    def get_many(self, keys):
+        generations = self._generations(keys)
+        self._local.generations = generations
+        store_keys = [self._store_key(key, generations[key[:2]]) for key in keys]
+        found = self.store.get_many(store_keys)
+        return [encoding.loads(found[key]) if key in found else None for key in store_keys]
+
+    def set_many(self, items):
+        generations = getattr(self._local, 'generations', None) or {}
+        self._local.generations = None
+        missing = [key for key, _ in items if key[:2] not in generations]
+        if missing:
+            generations = dict(generations)
+            generations.update(self._generations(missing))
+        self.store.set_many(dict([(self._store_key(key, generations[key[:2]]), encoding.dumps(resource))
+                                  for key, resource in items]),
+                            self.ttl)
+
+    def invalidate(self, type_, id_):
+        self.store.set_many({self._generation_key(type_, id_): encoding.dumps(uuid.uuid4().hex)}, None)
+
+    def clear(self):
+        self.store.clear()
+
+
+class LocalStore(object):
+    """In-process stand-in for a shared key-value store, with the interface
+    required by the :class:`~compound_jsonapi.cache.StoreCache`."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            result = {}
+            for key in keys:
+                entry = self._values.get(key)
+                if entry is not None and (entry[0] is None or entry[0] >= now):
+                    result[key] = entry[1]
+            return result
+
+    def set_many(self, mapping, ttl=None):
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._values[key] = (expires, value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,457 @@
+"""
+:mod:`compound_jsonapi.context`
+===============================
+
+Provides the :class:`~compound_jsonapi.context.DumpContext` that holds all the
+state needed while serialising a single compound JSONAPI document and that
+serialises the included resources.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import hashlib
+import threading
+
+import marshmallow as ma
+
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+from .registry import ResourceRegistry
+
+_local = threading.local()
+_EMPTY = {}
+
+
+def _difference(paths, other):
+    """Return the include ``paths`` that are not in the ``other`` paths."""
+    result = {}
+    for name, subtree in paths.items():
+        if name not in other:
+            result[name] = subtree
+        else:
+            difference = _difference(subtree, other[name])
+            if difference:
+                result[name] = difference
+    return result
+
+
+def _union(paths, other):
+    """Return the union of the include ``paths`` and the ``other`` paths."""
+    result = dict(paths)
+    for name, subtree in other.items():
+        result[name] = _union(result[name], subtree) if name in result else subtree
+    return result
+
+
+class DumpContext(object):
+    """The :class:`~compound_jsonapi.context.DumpContext` is created by the root
+    :class:`~compound_jsonapi.schema.Schema` for every call to ``dump`` and is
+    made available to all :class:`~compound_jsonapi.fields.Relationship` that
+    are serialised as part of that call. As no dump state is stored on the
+    :class:`~compound_jsonapi.schema.Schema` instances and marshmallow's errors
+    are kept per thread, a single instance can be re-used for any number of
+    dumps and shared between threads.
+
+    Related objects are not serialised when the
+    :class:`~compound_jsonapi.fields.Relationship` is serialised, but are queued
+    by type via :func:`~compound_jsonapi.context.DumpContext.enqueue`.
+    :func:`~compound_jsonapi.context.DumpContext.dump_included` then serialises
+    the queued objects one type at a time, so that the stack depth does not
+    depend on the depth of the object graph.
+
+    If the root :class:`~compound_jsonapi.schema.Schema` has ``include_paths``,
+    then the remaining include paths are tracked for each resource and related
+    objects are only queued along those paths. If a resource is reached again
+    with include paths that were not followed yet, then only the new paths are
+    followed from the resource, without serialising it again.
+
+    If the root :class:`~compound_jsonapi.schema.Schema` has a ``cache``, then
+    included resources are taken from the cache where possible (see
+    :mod:`~compound_jsonapi.cache`).
+    """
+
+    def __init__(self, root):
+        """
+        :param root: The root :class:`~compound_jsonapi.schema.Schema` that is
+                     being dumped
+        :type root: :class:`~compound_jsonapi.schema.Schema`
+        """
+        self.root = root
+        self.include_schemas = root.include_schemas
+        self.include_paths = root.include_paths
+        self.cache = root.cache
+        self.registry = ResourceRegistry()
+        self.pending = OrderedDict()
+        self.errors = {}
+        self._keys = {}
+        self._paths = {}
+        self._variants = {}
+        #: The :class:`~compound_jsonapi.instrumentation.Stats` if instrumentation is enabled
+        self.stats = None
+        #: The relationship values that have been resolved asynchronously or by
+        #: a batch ``loader``, by ``(id(obj), field_name)``, or ``None`` if no
+        #: values are resolved in advance
+        self.resolved = None
+        self._loaders = root._node is not None and any([node.loaders for node in
+                                                        [root._node] + list(root._node.reachable)])
+        self._prefetched = set()
+        if self._loaders:
+            self.resolved = {}
+        self._previous = []
+
+    @classmethod
+    def current(cls):
+        """Return the :class:`~compound_jsonapi.context.DumpContext` that is
+        active in the current thread or ``None`` if no dump is in progress."""
+        return getattr(_local, 'context', None)
+
+    def key(self, node, obj):
+        """Return the ``(type, id)`` key of the ``obj`` for the ``node``\ 's
+        type. Keys are cached by object identity for the duration of the dump,
+        so the id of an object that is related to many other objects is only
+        extracted once. The cache holds a reference to each ``obj``, so that its
+        identity cannot be re-used while it is cached. Streaming dumps drop the
+        cached keys once the objects have been written (see
+        :func:`~compound_jsonapi.context.DumpContext.release`).
+
+        :param node: The :class:`~compound_jsonapi.graph.SchemaNode` of the ``obj``
+        :type node: :class:`~compound_jsonapi.graph.SchemaNode`
+        :param obj: The object to get the key for
+        :return: The ``(type, id)`` key
+        :rtype: ``tuple``
+        """
+        entry = self._keys.get(id(obj))
+        if entry is not None and entry[1][0] == node.type_:
+            return entry[1]
+        key = (node.type_, node.identify(obj))
+        self._keys[id(obj)] = (obj, key)
+        return key
+
+    def cached_key(self, obj):
+        """Return the ``(type, id)`` key that has been cached for the ``obj`` by
+        :func:`~compound_jsonapi.context.DumpContext.key`, or ``None`` if the
+        ``obj`` has no cached key."""
+        entry = self._keys.get(id(obj))
+        if entry is not None:
+            return entry[1]
+        return None
+
+    def visit_root(self, node, obj):
+        """Mark the primary ``obj`` as visited, so that it is not included.
+
+        :param node: The :class:`~compound_jsonapi.graph.SchemaNode` of the root
+        :type node: :class:`~compound_jsonapi.graph.SchemaNode`
+        :param obj: The primary object
+        :return: The ``(type, id)`` key of the ``obj``
+        :rtype: ``tuple``
+        """
+        key = self.key(node, obj)
+        self.registry.visit(key)
+        if self.include_paths is not None:
+            self._paths[key] = self.include_paths
+        return key
+
+    def subtree(self, obj, name):
+        """Return the include paths below the relationship ``name`` of the
+        ``obj`` that is being serialised, or ``None`` if the relationship is not
+        on an include path. Always returns an empty ``dict`` if the root
+        :class:`~compound_jsonapi.schema.Schema` has no ``include_paths``."""
+        if self.include_paths is None:
+            return _EMPTY
+        entry = self._keys.get(id(obj))
+        if entry is None:
+            return None
+        paths = self._paths.get(entry[1])
+        if paths is None:
+            return None
+        return paths.get(name)
+
+    def expand(self, node, obj, key, subtree):
+        """Queue the related ``obj`` if it has not been visited yet and is on an
+        include path. If it has already been visited, then any paths in the
+        ``subtree`` that have not been followed from it yet are followed.
+
+        :param node: The :class:`~compound_jsonapi.graph.SchemaNode` of the ``obj``
+        :type node: :class:`~compound_jsonapi.graph.SchemaNode`
+        :param obj: The related object
+        :param key: The ``(type, id)`` key of the ``obj``
+        :type key: ``tuple``
+        :param subtree: The include paths below the relationship, as returned by
+                        :func:`~compound_jsonapi.context.DumpContext.subtree`
+        :type subtree: ``dict``
+        """
+        if self.include_paths is None:
+            if self.registry.visit(key):
+                self.enqueue(node, obj, key)
+            elif self.stats is not None:
+                self.stats.count('dump.dedupe_hits')
+        elif subtree is not None:
+            current = self._paths.get(key)
+            if current is None:
+                self._paths[key] = subtree
+                if self.registry.visit(key):
+                    self.enqueue(node, obj, key)
+            else:
+                if self.stats is not None:
+                    self.stats.count('dump.dedupe_hits')
+                new = _difference(subtree, current)
+                if new:
+                    self._paths[key] = _union(current, new)
+                    self._follow(node, obj, new)
+
+    def prefetch(self, items):
+        """Load the related objects of all relationships with a batch ``loader``
+        for the ``(node, obj)`` ``items``. The ids of all objects are collected
+        first and each ``loader`` is then called once. The loaded objects are
+        stored in ``resolved``. Objects that have already been prefetched are
+        skipped.
+
+        :param items: The ``(node, obj)`` tuples to prefetch the related objects for
+        :type items: ``list``
+        """
+        if not self._loaders:
+            return
+        requests = OrderedDict()
+        for node, obj in items:
+            if not node.loaders or id(obj) in self._prefetched:
+                continue
+            self._prefetched.add(id(obj))
+            for field_name, field, target in node.loaders:
+                if target.type_ not in self.include_schemas:
+                    continue
+                value = node.schema.get_attribute(obj, field.attribute or field_name, None)
+                ids, entries = requests.setdefault(field.loader, (OrderedDict(), []))
+                entries.append(((id(obj), field_name), value, field.many))
+                if value is not None:
+                    for related_id in value if field.many else [value]:
+                        ids[related_id] = None
+        for loader, (ids, entries) in requests.items():
+            ids = list(ids)
+            loaded = loader(ids) if ids else {}
+            if not isinstance(loaded, dict):
+                loaded = dict(zip(ids, loaded))
+            for key, value, many in entries:
+                if value is None:
+                    self.resolved[key] = None
+                elif many:
+                    self.resolved[key] = [loaded[related_id] for related_id in value if related_id in loaded]
+                else:
+                    self.resolved[key] = loaded.get(value)
+
+    def release(self, node, objs):
+        """Release the ``objs`` of the ``node`` once they have been written, so
+        that a streaming dump does not keep them alive. Drops their prefetched
+        relationship values and clears the key cache. Objects that are still
+        queued keep their keys in the queue and visited objects are tracked by
+        key, so the cached keys are not needed any more.
+
+        :param node: The :class:`~compound_jsonapi.graph.SchemaNode` of the ``objs``
+        :type node: :class:`~compound_jsonapi.graph.SchemaNode`
+        :param objs: The objects that have been written
+        :type objs: ``list``
+        """
+        self._keys.clear()
+        for obj in objs:
+            self._prefetched.discard(id(obj))
+            if self.resolved is not None:
+                for field_name, _, _ in node.relationships:
+                    self.resolved.pop((id(obj), field_name), None)
+
+    def _follow(self, node, obj, paths=None):
+        """Follow the include ``paths`` from the ``obj``, which has already been
+        visited. If ``paths`` is ``None``, all relationships to included types
+        are followed."""
+        if self._loaders:
+            self.prefetch([(node, obj)])
+        for field_name, field, target in node.relationships:
+            if target.type_ not in self.include_schemas:
+                continue
+            subtree = _EMPTY if paths is None else paths.get(field.dump_to or field_name)
+            if subtree is not None:
+                if self.resolved is not None and (id(obj), field_name) in self.resolved:
+                    value = self.resolved[(id(obj), field_name)]
+                else:
+                    value = node.schema.get_attribute(obj, field.attribute or field_name, None)
+                if value is not None and value is not ma.missing:
+                    for part in value if field.many else [value]:
+                        self.expand(target, part, self.key(target, part), subtree)
+
+    def enqueue(self, node, obj, key):
+        """Queue the related ``obj`` to be serialised with the ``node``\ 's
+        :class:`~compound_jsonapi.schema.Schema`.
+
+        :param node: The :class:`~compound_jsonapi.graph.SchemaNode` to serialise with
+        :type node: :class:`~compound_jsonapi.graph.SchemaNode`
+        :param obj: The object to serialise
+        :param key: The ``(type, id)`` key of the ``obj``
+        :type key: ``tuple``
+        """
+        batch = self.pending.get(node)
+        if batch is None:
+            batch = self.pending[node] = ([], [])
+        batch[0].append(obj)
+        batch[1].append(key)
+
+    def _next_node(self):
+        """Return the next :class:`~compound_jsonapi.graph.SchemaNode` to
+        serialise. Prefers nodes that cannot be reached from any other pending
+        node, as no further objects can be queued for those, so that each type
+        is serialised in as few batches as possible."""
+        for node in self.pending:
+            if not any([node in other.reachable for other in self.pending if other is not node]):
+                return node
+        return next(iter(self.pending))
+
+    def iter_included(self):
+        """Serialise the queued related objects one batch at a time (see
+        :func:`~compound_jsonapi.context.DumpContext.dump_next`). The
+        :class:`~compound_jsonapi.context.DumpContext` is only active while a
+        batch is serialised, so the batches can be consumed lazily.
+
+        :return: Generator yielding a ``list`` of ``((type, id), resource)`` tuples
+                 per batch. The objects of each batch are released once they have
+                 been serialised (see
+                 :func:`~compound_jsonapi.context.DumpContext.release`)
+        """
+        while self.pending:
+            batch = self.dump_next(release=True)
+            if batch:
+                yield batch
+
+    def dump_next(self, release=False):
+        """Serialise the next batch of queued related objects. All objects queued
+        for a :class:`~compound_jsonapi.graph.SchemaNode` are serialised in a
+        single call to ``dump``, which queues the objects they relate to. The
+        related objects of all queued objects are prefetched before the batch is
+        serialised. If ``stats`` are collected, the time spent and the objects serialised per
+        type are counted. Errors are collected in ``errors``, by resource type
+        and id, and only the objects that failed are left out of the batch.
+
+        :param release: Whether to release the objects once they have been
+                        serialised
+        :type release: ``bool``
+        :return: ``list`` of ``((type, id), resource)`` tuples
+        """
+        stats = self.stats
+        if self._loaders:
+            self.prefetch([(node, obj) for node, (objs, _) in self.pending.items() for obj in objs])
+        with self:
+            node = self._next_node()
+            objs, keys = self.pending.pop(node)
+            for obj, key in zip(objs, keys):
+                self._keys[id(obj)] = (obj, key)
+            if stats is None:
+                resources, batch_errors = self._dump_batch(node, objs, keys)
+            else:
+                started = timer()
+                resources, batch_errors = self._dump_batch(node, objs, keys)
+                stats.time('dump.included', timer() - started)
+                stats.count('dump.resources', len(objs), node.type_)
+        if release:
+            self.release(node, objs)
+        if batch_errors:
+            type_errors = self.errors.setdefault(node.type_, {})
+            if node.schema.opts.index_errors:
+                type_errors.update([(keys[idx][1], value) for idx, value in batch_errors.items()])
+            else:
+                for value in batch_errors.values():
+                    type_errors.update(value)
+            return [(key, resource) for key, resource in zip(keys, resources) if resource is not None]
+        return list(zip(keys, resources))
+
+    def _dump_batch(self, node, objs, keys):
+        """Serialise the ``objs`` with the ``node``\\ 's
+        :class:`~compound_jsonapi.schema.Schema`. If there is a ``cache`` and the
+        :class:`~compound_jsonapi.schema.Schema` has a ``Meta.version_attr``,
+        then cached resource objects are used and only the remaining objects are
+        serialised and cached. The relationships of the cached objects are
+        followed without serialising them.
+
+        :return: A tuple of the form (``resources``, ``errors``), see
+                 :func:`~compound_jsonapi.context.DumpContext._dump_objs`
+        """
+        version_attr = getattr(node.schema.Meta, 'version_attr', None)
+        if self.cache is None or version_attr is None:
+            return self._dump_objs(node, objs)
+        get_attribute = node.schema.get_attribute
+        variant = self._variant(node)
+        cache_keys = [key + (str(get_attribute(obj, version_attr, None)), variant) for obj, key in zip(objs, keys)]
+        resources = self.cache.get_many(cache_keys)
+        misses = []
+        for idx, resource in enumerate(resources):
+            if resource is None:
+                misses.append(idx)
+            else:
+                self._follow(node, objs[idx],
+                             self._paths.get(keys[idx], _EMPTY) if self.include_paths is not None else None)
+        if self.stats is not None:
+            self.stats.count('dump.cache_hits', len(objs) - len(misses), node.type_)
+            self.stats.count('dump.cache_misses', len(misses), node.type_)
+        errors = {}
+        if misses:
+            missed, missed_errors = self._dump_objs(node, [objs[idx] for idx in misses])
+            for idx, resource in zip(misses, missed):
+                resources[idx] = resource
+            errors = dict([(misses[idx], value) for idx, value in missed_errors.items()])
+            self.cache.set_many([(cache_keys[idx], resources[idx]) for idx in misses if resources[idx] is not None])
+        return resources, errors
+
+    def _dump_objs(self, node, objs):
+        """Serialise the ``objs`` with the ``node``\\ 's
+        :class:`~compound_jsonapi.schema.Schema` in a single call. If any of them
+        fail to validate, they are serialised one at a time, so that the valid
+        resource objects are still returned.
+
+        :return: A tuple of the form (``resources``, ``errors``), where
+                 ``resources`` holds ``None`` for each object that failed and
+                 ``errors`` is keyed by the index of the object
+        """
+        data, errors = node.schema.dump_resources(objs, many=True)
+        if not errors:
+            return data['data'], {}
+        resources = []
+        errors = {}
+        for idx, obj in enumerate(objs):
+            data, obj_errors = node.schema.dump_resources(obj, many=False)
+            if obj_errors:
+                resources.append(None)
+                errors[idx] = obj_errors
+            else:
+                resources.append(data['data'])
+        return resources, errors
+
+    def _variant(self, node):
+        """Return the cache variant of the ``node``\\ 's
+        :class:`~compound_jsonapi.schema.Schema`, which identifies the schema
+        class, the serialised fields, and the relationships that link to
+        included types, as these determine the serialised resource object."""
+        variant = self._variants.get(node)
+        if variant is None:
+            schema = node.schema
+            parts = ['{0}.{1}'.format(schema.__class__.__module__, schema.__class__.__name__),
+                     ','.join(sorted(schema.fields)),
+                     ','.join(sorted([field_name for field_name, _, target in node.relationships
+                                      if target.type_ in self.include_schemas]))]
+            variant = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+            self._variants[node] = variant
+        return variant
+
+    def dump_included(self):
+        """Serialise all queued related objects into the included resources of
+        the ``registry``.
+
+        :return: The errors that occurred, by resource type and id
+        :rtype: ``dict``
+        """
+        for batch in self.iter_included():
+            for key, resource in batch:
+                self.registry.include(key, resource)
+        return self.errors
+
+    def __enter__(self):
+        self._previous.append(getattr(_local, 'context', None))
+        _local.context = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.context = self._previous.pop()
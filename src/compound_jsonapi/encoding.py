@@ -0,0 +1,96 @@
+"""
+:mod:`compound_jsonapi.encoding`
+================================
+
+Provides the :func:`~compound_jsonapi.encoding.dumps` and
+:func:`~compound_jsonapi.encoding.loads` functions that convert compound
+documents directly to and from UTF-8 encoded ``bytes``, which are used by
+:func:`~compound_jsonapi.schema.Schema.dumps_bytes` and
+:func:`~compound_jsonapi.schema.Schema.loads_bytes`.
+
+The fastest available backend is used: `orjson`_ if it is installed, then
+`ujson`_, and otherwise the standard library ``json`` module. The backend can be
+changed with :func:`~compound_jsonapi.encoding.use`.
+
+.. _`orjson`: https://pypi.org/project/orjson/
+.. _`ujson`: https://pypi.org/project/ujson/
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj).encode('utf-8')
+
+
+def _backends():
+    """Return the available backends as a ``dict`` of name to ``(dumps, loads)``."""
+    backends = {'json': (_json_dumps, _json_loads)}
+    if ujson is not None:
+        backends['ujson'] = (_ujson_dumps, ujson.loads)
+    if orjson is not None:
+        backends['orjson'] = (orjson.dumps, orjson.loads)
+    return backends
+
+
+def use(name=None, dumps=None, loads=None):
+    """Select the backend used to encode and decode documents. Either the
+    ``name`` of one of the built-in backends (``'orjson'``, ``'ujson'``, or
+    ``'json'``) is given, or a custom pair of ``dumps`` and ``loads`` functions.
+    If neither is given, then the fastest available backend is selected.
+
+    :param name: The name of the backend to use
+    :type name: ``str``
+    :param dumps: Function that encodes an object into UTF-8 ``bytes``
+    :param loads: Function that decodes ``bytes`` or a ``str`` into an object
+    :return: The name of the selected backend, or ``None`` for custom functions
+    :raises ValueError: If the named backend is not available
+    """
+    global backend, _dumps, _loads
+    if dumps is not None and loads is not None:
+        backend, _dumps, _loads = None, dumps, loads
+        return backend
+    backends = _backends()
+    if name is None:
+        name = [name for name in ('orjson', 'ujson', 'json') if name in backends][0]
+    if name not in backends:
+        raise ValueError('The {0} backend is not available'.format(name))
+    backend = name
+    _dumps, _loads = backends[name]
+    return backend
+
+
+def dumps(obj):
+    """Encode the ``obj`` into UTF-8 encoded JSON ``bytes``."""
+    return _dumps(obj)
+
+
+def loads(data):
+    """Decode the JSON ``data``, which is either ``bytes`` or a ``str``."""
+    return _loads(data)
+
+
+backend = None
+_dumps = None
+_loads = None
+use()
@@ -9,7 +9,10 @@ defining relationships between :class:`~compound_jsonapi.schema.Schema`\ s.
 """
 import marshmallow as ma
 
+from .context import DumpContext
+
 _RECURSIVE_NESTED = 'self'
+_MISSING = object()
 
 
 class Relationship(ma.fields.Field):
@@ -19,38 +22,51 @@ class Relationship(ma.fields.Field):
     or a dotted classname string.
     """
 
-    def __init__(self, schema, many=False, **kwargs):
+    def __init__(self, schema, many=False, loader=None, **kwargs):
         """
         :param schema: The :class:`~compound_jsonapi.schema.Schema` that defines
                        how to handle the linked data.
         :param many: By default the relationship is one-to-one. Set this to
                      ``true`` to create a one-to-many relationship
         :type many: ``bool``
+        :param loader: Optional function that loads the related objects in a
+                       batch. If set, the attribute holds the id(s) of the
+                       related objects, which are collected for all objects
+                       that are serialised together. The ``loader`` is then
+                       called once with the ``list`` of ids and returns either a
+                       ``dict`` of ids to objects or a ``list`` of objects in
+                       the order of the ids. Relationships that share the same
+                       ``loader`` are loaded in the same call.
         """
         super(Relationship, self).__init__(**kwargs)
         self.many = many
-        self.__schema = schema
+        self.loader = loader
+        self._target = schema
+        self._node = None
 
     @property
     def schema(self):
-        """Property that returns an instantiated :class:`~compound_jsonapi.schema.Schema`
-        for the relationship."""
-        if isinstance(self.__schema, ma.base.SchemaABC):
-            pass
-        elif isinstance(self.__schema, type) and issubclass(self.__schema, ma.base.SchemaABC):
-            self.__schema = self.__schema()
-        elif isinstance(self.__schema, ma.compat.basestring):
-            if self.__schema == _RECURSIVE_NESTED:
-                parent_class = self.parent.__class__
-                self.__schema = parent_class()
-            else:
-                schema_class = ma.class_registry.get_class(self.__schema)
-                self.__schema = schema_class()
-        self.__schema._visited = self.root._visited
-        self.__schema._included_data = self.root._included_data
-        self.__schema.include_schemas = self.root.include_schemas
-        self.__schema._parent = self.root
-        return self.__schema
+        """Property that returns the instantiated :class:`~compound_jsonapi.schema.Schema`
+        for the relationship. The schema is resolved when the root
+        :class:`~compound_jsonapi.schema.Schema` is compiled (see
+        :func:`~compound_jsonapi.schema.Schema.compile`)."""
+        if self._node is None:
+            self.root.compile()
+        return self._node.schema
+
+    def get_value(self, obj, attr, accessor=None, default=ma.missing):
+        """Return the related value(s) from the ``obj``. During an asynchronous
+        dump (see :func:`~compound_jsonapi.schema.Schema.dump_async`) or a dump
+        with a ``loader``, the values that have already been resolved are used
+        and relationships to types that are not included are not accessed."""
+        context = DumpContext.current()
+        if context is not None and context.resolved is not None:
+            if self._node.type_ not in context.include_schemas:
+                return None
+            value = context.resolved.get((id(obj), attr), _MISSING)
+            if value is not _MISSING:
+                return value
+        return super(Relationship, self).get_value(obj, attr, accessor=accessor, default=default)
 
     def _deserialize(self, value, attr=None, data=None):
         """Deserialise the given ``value``. Returns a tuple ``(type, id)``
@@ -66,32 +82,68 @@ class Relationship(ma.fields.Field):
         :class:`~compound_jsonapi.schema.Schema` is included in the list of
         :class:`~compound_jsonapi.schema.Schema`\ s that have been set in the
         ``include_schemas`` parameter when creating the root
-        :class:`~compound_jsonapi.schema.Schema`. Uses the ``_visited`` property
-        of the :func:`~compound_jsonapi.schema.Schema.schema` to correctly handle
-        circular relationship structures."""
-        if self.schema.Meta.type_ in self.schema.include_schemas and value is not None:
-            visited = getattr(self.schema, '_visited')
-            included_data = getattr(self.schema, '_included_data')
+        :class:`~compound_jsonapi.schema.Schema`. Uses the ``registry`` of the
+        active :class:`~compound_jsonapi.context.DumpContext` to correctly handle
+        circular relationship structures. Related objects that have not been seen
+        yet and that are on the include paths are queued in the
+        :class:`~compound_jsonapi.context.DumpContext` and serialised after the
+        current level. Requires the root
+        :class:`~compound_jsonapi.schema.Schema` to have been compiled."""
+        context = DumpContext.current()
+        node = self._node
+        if self._linked(context, value):
+            type_ = node.type_
+            subtree = context.subtree(data, self.dump_to or self.name)
             if self.many:
                 result = []
                 for part in value:
-                    if (self.schema.Meta.type_, str(self.schema.get_attribute(part, 'id', None))) not in visited:
-                        visited.append((self.schema.Meta.type_, str(self.schema.get_attribute(part, 'id', None))))
-                        included, errors = self.schema.dump(part, many=False)
-                        included_data[(self.schema.Meta.type_,
-                                       str(self.schema.get_attribute(part, 'id', None)))] = included['data']
-                    result.append({'type': self.schema.Meta.type_,
-                                   'id': str(self.schema.get_attribute(part, 'id', None))})
+                    key = context.key(node, part)
+                    context.expand(node, part, key, subtree)
+                    result.append({'type': type_, 'id': key[1]})
+                if context.stats is not None:
+                    context.stats.count('dump.edges', len(result))
                 return result
             else:
-                if (self.schema.Meta.type_, str(self.schema.get_attribute(value, 'id', None))) not in visited:
-                    visited.append((self.schema.Meta.type_, str(self.schema.get_attribute(value, 'id', None))))
-                    included, errors = self.schema.dump(value, many=False)
-                    included_data[(self.schema.Meta.type_,
-                                   str(self.schema.get_attribute(value, 'id', None)))] = included['data']
-                return {'type': self.schema.Meta.type_, 'id': str(self.schema.get_attribute(value, 'id', None))}
+                key = context.key(node, value)
+                context.expand(node, value, key, subtree)
+                if context.stats is not None:
+                    context.stats.count('dump.edges')
+                return {'type': type_, 'id': key[1]}
         else:
             if self.many:
                 return []
             else:
                 return None
+
+    def serialize_ids(self, values):
+        """Serialise the resource linkage for a column of ids, without accessing
+        the related objects, as used by
+        :func:`~compound_jsonapi.schema.Schema.dump_columns`. As for
+        :func:`~compound_jsonapi.fields.Relationship._serialize`, the linkage is
+        only serialised if the relationship's type is included.
+
+        :param values: The id of the related object for each row, or a ``list``
+                       of ids if the relationship is one-to-many
+        :type values: ``list``
+        :return: ``list`` with the resource linkage for each row
+        """
+        context = DumpContext.current()
+        empty = [] if self.many else None
+        if not self._linked(context, values):
+            return [empty for _ in values]
+        type_ = self._node.type_
+        if self.many:
+            result = [[{'type': type_, 'id': str(part)} for part in value] if value is not None else empty
+                      for value in values]
+            edges = sum([len(value) for value in result])
+        else:
+            result = [{'type': type_, 'id': str(value)} if value is not None else empty for value in values]
+            edges = len([value for value in result if value is not None])
+        if context.stats is not None:
+            context.stats.count('dump.edges', edges)
+        return result
+
+    def _linked(self, context, value):
+        """Return whether the resource linkage for ``value`` is serialised in the
+        ``context``, which requires the relationship's type to be included."""
+        return context is not None and self._node.type_ in context.include_schemas and value is not None
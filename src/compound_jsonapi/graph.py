@@ -0,0 +1,193 @@
+"""
+:mod:`compound_jsonapi.graph`
+=============================
+
+Provides the :class:`~compound_jsonapi.graph.SchemaNode` and the
+:func:`~compound_jsonapi.graph.compile_schema` function that resolves all
+:class:`~compound_jsonapi.fields.Relationship` of a
+:class:`~compound_jsonapi.schema.Schema` into a graph of
+:class:`~compound_jsonapi.graph.SchemaNode`. The graph is built once and then
+only read while serialising, so that no schema resolution happens for each
+related object.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import threading
+
+import marshmallow as ma
+
+from collections import OrderedDict
+
+from . import pool
+from .fields import Relationship, _RECURSIVE_NESTED
+from .pool import get_schema, _freeze
+
+_lock = threading.RLock()
+_class_nodes = OrderedDict()
+_class_names = {}
+
+
+class SchemaNode(object):
+    """A :class:`~compound_jsonapi.graph.SchemaNode` links an instantiated
+    :class:`~compound_jsonapi.schema.Schema` with the
+    :class:`~compound_jsonapi.graph.SchemaNode` of each of its
+    :class:`~compound_jsonapi.fields.Relationship`. Apart from the root of a
+    graph, each node is shared by all graphs that reference its schema class.
+    """
+    __slots__ = ('schema', 'type_', 'identify', 'relationships', 'loaders', '_reachable')
+
+    def __init__(self, schema):
+        """
+        :param schema: The :class:`~compound_jsonapi.schema.Schema` this node
+                       represents
+        :type schema: :class:`~compound_jsonapi.schema.Schema`
+        """
+        self.schema = schema
+        self.type_ = schema.Meta.type_
+        #: Function returning the ``str`` id of an object of this node's type
+        self.identify = schema._identifier()
+        #: ``tuple`` of ``(field_name, relationship, node)`` tuples
+        self.relationships = ()
+        #: The ``relationships`` that have a batch ``loader``
+        self.loaders = ()
+        self._reachable = None
+
+    @property
+    def reachable(self):
+        """The ``frozenset`` of :class:`~compound_jsonapi.graph.SchemaNode`
+        that can be reached by following the relationships of this node."""
+        if self._reachable is None:
+            reachable = set()
+            stack = [target for _, _, target in self.relationships]
+            while stack:
+                node = stack.pop()
+                if node not in reachable:
+                    reachable.add(node)
+                    stack.extend([target for _, _, target in node.relationships])
+            self._reachable = frozenset(reachable)
+        return self._reachable
+
+    def __repr__(self):
+        return '<SchemaNode({0})>'.format(self.type_)
+
+
+def compile_schema(schema):
+    """Compile the graph of :class:`~compound_jsonapi.graph.SchemaNode` that
+    starts at the given ``schema``. Every :class:`~compound_jsonapi.fields.Relationship`
+    that is reachable from the ``schema`` is linked to the
+    :class:`~compound_jsonapi.graph.SchemaNode` of its related schema.
+
+    :param schema: The root :class:`~compound_jsonapi.schema.Schema`
+    :type schema: :class:`~compound_jsonapi.schema.Schema`
+    :return: The root node of the compiled graph
+    :rtype: :class:`~compound_jsonapi.graph.SchemaNode`
+    """
+    with _lock:
+        node = SchemaNode(schema)
+        _link(node)
+        return node
+
+
+def clear():
+    """Remove all shared :class:`~compound_jsonapi.graph.SchemaNode`\ s. Called
+    by :func:`~compound_jsonapi.pool.clear`."""
+    with _lock:
+        _class_nodes.clear()
+        _class_names.clear()
+
+
+def _target_class(relationship, owner_class):
+    """Return the schema class of the ``relationship`` declared on the
+    ``owner_class``."""
+    target = relationship._target
+    if isinstance(target, ma.base.SchemaABC):
+        return target.__class__
+    elif isinstance(target, type) and issubclass(target, ma.base.SchemaABC):
+        return target
+    elif target == _RECURSIVE_NESTED:
+        return owner_class
+    else:
+        return ma.class_registry.get_class(target)
+
+
+def _field_names(schema_class):
+    """Return the serialised names of the declared fields of all schema classes
+    that can be reached from the ``schema_class``, by resource type. The result
+    is cached per class."""
+    names = _class_names.get(schema_class)
+    if names is None:
+        names = {}
+        seen = set()
+        stack = [schema_class]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            type_names = names.setdefault(current.Meta.type_, set())
+            for field_name, field in current._declared_fields.items():
+                type_names.add(field.dump_to or field_name)
+                if isinstance(field, Relationship):
+                    stack.append(_target_class(field, current))
+        names = dict([(type_, frozenset(type_names)) for type_, type_names in names.items()])
+        _class_names[schema_class] = names
+    return names
+
+
+def _reduce(schema_class, fieldsets):
+    """Reduce the sparse ``fieldsets`` to the types and declared field names
+    that can be reached from the ``schema_class``, so that unknown names do
+    not create additional shared instances."""
+    if fieldsets is None:
+        return None
+    names = _field_names(schema_class)
+    return dict([(type_, fieldset & names[type_]) for type_, fieldset in fieldsets.items() if type_ in names])
+
+
+def _class_node(schema_class, fieldsets=None):
+    """Return the shared :class:`~compound_jsonapi.graph.SchemaNode` for the
+    ``schema_class`` and the sparse ``fieldsets``, creating and linking it if
+    needed. The ``fieldsets`` are first reduced to the declared fields. The node
+    uses the shared instance from the :mod:`~compound_jsonapi.pool`. Once
+    ``pool.max_size`` nodes are held, the least recently used one is removed."""
+    fieldsets = _reduce(schema_class, fieldsets)
+    key = (schema_class, _freeze(fieldsets))
+    node = _class_nodes.get(key)
+    if node is None:
+        if fieldsets is None:
+            node = SchemaNode(get_schema(schema_class))
+        else:
+            node = SchemaNode(get_schema(schema_class, fields=fieldsets))
+        _class_nodes[key] = node
+        while len(_class_nodes) > pool.max_size:
+            _class_nodes.popitem(last=False)
+        _link(node)
+    else:
+        _class_nodes.move_to_end(key)
+    return node
+
+
+def _resolve(relationship, owner):
+    """Resolve the schema of the ``relationship`` declared on the ``owner``
+    :class:`~compound_jsonapi.schema.Schema` into a
+    :class:`~compound_jsonapi.graph.SchemaNode`. Schema classes are
+    instantiated with the ``owner``\ 's sparse ``fieldsets``."""
+    target = relationship._target
+    if isinstance(target, ma.base.SchemaABC):
+        node = SchemaNode(target)
+        _link(node)
+        return node
+    return _class_node(_target_class(relationship, owner.__class__), getattr(owner, 'fieldsets', None))
+
+
+def _link(node):
+    """Link all :class:`~compound_jsonapi.fields.Relationship` of the ``node``\\ 's
+    schema to their :class:`~compound_jsonapi.graph.SchemaNode`."""
+    relationships = []
+    for field_name, field in node.schema.fields.items():
+        if isinstance(field, Relationship):
+            if field._node is None:
+                field._node = _resolve(field, node.schema)
+            relationships.append((field_name, field, field._node))
+    node.relationships = tuple(relationships)
+    node.loaders = tuple([relationship for relationship in relationships if relationship[1].loader is not None])
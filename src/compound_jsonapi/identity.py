@@ -0,0 +1,82 @@
+"""
+:mod:`compound_jsonapi.identity`
+================================
+
+Provides the :class:`~compound_jsonapi.identity.IdentityMap` that is shared
+by several calls to :func:`~compound_jsonapi.schema.Schema.load`, such as the
+loads of the pages of a paginated collection or of the responses within one
+session. The identity map is owned by the caller and passed to each load as the
+``identity_map`` parameter.
+
+Included resources whose ``(type, id)`` is already in the identity map are not
+deserialised or validated again and the object from the identity map is used
+instead. Links to resources that are not included in the document are also
+resolved from the identity map. The primary resources are always
+deserialised and replace any earlier objects in the identity map.
+
+As the objects are re-used as they are, the identity map assumes that included
+resources do not change between loads. Objects that are known to have changed
+can be removed with :func:`~compound_jsonapi.identity.IdentityMap.invalidate`.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import threading
+
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class IdentityMap(object):
+    """Maps the ``(type, id)`` keys of resources to their deserialised objects.
+    Once it holds ``max_size`` objects, the least recently used objects are
+    evicted."""
+
+    def __init__(self, max_size=10000):
+        """
+        :param max_size: The maximum number of objects to hold
+        :type max_size: ``int``
+        """
+        self.max_size = max_size
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the object for the ``(type, id)`` ``key``, or ``default`` if it
+        is not in the identity map."""
+        with self._lock:
+            obj = self._objects.pop(key, _MISSING)
+            if obj is _MISSING:
+                return default
+            self._objects[key] = obj
+            return obj
+
+    def update(self, items):
+        """Add the objects to the identity map, replacing any objects with the
+        same keys.
+
+        :param items: ``((type, id), obj)`` tuples to add
+        :type items: ``list``
+        """
+        with self._lock:
+            for key, obj in items:
+                self._objects.pop(key, None)
+                self._objects[key] = obj
+            while len(self._objects) > self.max_size:
+                self._objects.popitem(last=False)
+
+    def invalidate(self, type_, id_):
+        """Remove the object for the resource ``type_`` and ``id_``."""
+        with self._lock:
+            self._objects.pop((type_, str(id_)), None)
+
+    def clear(self):
+        """Remove all objects."""
+        with self._lock:
+            self._objects.clear()
+
+    def __contains__(self, key):
+        return key in self._objects
+
+    def __len__(self):
+        return len(self._objects)
@@ -0,0 +1,135 @@
+"""
+:mod:`compound_jsonapi.instrumentation`
+=======================================
+
+Provides the :class:`~compound_jsonapi.instrumentation.Instrumentation`
+interface for reporting timings and counters of the individual phases of
+:func:`~compound_jsonapi.schema.Schema.dump` and
+:func:`~compound_jsonapi.schema.Schema.load`. Instrumentation is disabled unless
+an :class:`~compound_jsonapi.instrumentation.Instrumentation` is set as the
+``instrumentation`` of the root :class:`~compound_jsonapi.schema.Schema`.
+
+The statistics are collected while the document is processed and reported
+once at the end, so forwarding them to a metrics system only requires
+implementing the two methods of the interface::
+
+    class StatsdInstrumentation(Instrumentation):
+
+        def __init__(self, client):
+            self.client = client
+
+        def timing(self, name, seconds, tags=None):
+            self.client.timing(name, seconds * 1000)
+
+        def count(self, name, value, tags=None):
+            if tags:
+                name = '{0}.{1}'.format(name, tags['type'])
+            self.client.incr(name, value)
+
+The following timings (in seconds) are reported:
+
+* ``dump.primary``: Serialising the primary data
+* ``dump.included``: Serialising the included resources
+* ``dump.wrap``: Wrapping the serialised data into resource objects
+* ``load.primary``: Deserialising the primary data
+* ``load.included``: Deserialising the included resources
+* ``load.fixup``: Linking the deserialised relationships
+
+The following counters are reported:
+
+* ``dump.resources``: The resources serialised, tagged by ``type``
+* ``dump.edges``: The relationship links serialised
+* ``dump.dedupe_hits``: The links to resources that had already been visited
+* ``dump.included``: The resources in the ``included`` list
+* ``load.resources``: The resources deserialised, tagged by ``type``
+* ``load.reused``: The included resources taken from the identity map, tagged
+  by ``type``
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+
+
+class Instrumentation(object):
+    """Base class for receiving the timings and counters of dumps and loads.
+    The default implementation ignores them."""
+
+    def timing(self, name, seconds, tags=None):
+        """Report the time spent in the phase ``name``.
+
+        :param name: The name of the phase
+        :type name: ``str``
+        :param seconds: The time spent
+        :type seconds: ``float``
+        :param tags: Optional tags
+        :type tags: ``dict``
+        """
+        pass
+
+    def count(self, name, value, tags=None):
+        """Report the counter ``name``.
+
+        :param name: The name of the counter
+        :type name: ``str``
+        :param value: The value to add to the counter
+        :type value: ``int``
+        :param tags: Optional tags, such as the resource ``type``
+        :type tags: ``dict``
+        """
+        pass
+
+
+class Recorder(Instrumentation):
+    """:class:`~compound_jsonapi.instrumentation.Instrumentation` that adds up
+    all reported timings and counters in ``timings`` and ``counts``. Tagged
+    counters are stored under the name with the tag values appended, such as
+    ``'dump.resources.comments'``."""
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    def timing(self, name, seconds, tags=None):
+        name = _tagged(name, tags)
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def count(self, name, value, tags=None):
+        name = _tagged(name, tags)
+        self.counts[name] = self.counts.get(name, 0) + value
+
+
+def _tagged(name, tags):
+    """Append the values of the ``tags`` to the ``name``."""
+    if tags:
+        return '.'.join([name] + [str(tags[key]) for key in sorted(tags)])
+    return name
+
+
+class Stats(object):
+    """Collects the timings and counters of a single dump or load, which are
+    then passed to the :class:`~compound_jsonapi.instrumentation.Instrumentation`
+    via :func:`~compound_jsonapi.instrumentation.Stats.report`."""
+    __slots__ = ('timings', 'counts')
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    def time(self, name, seconds):
+        """Add ``seconds`` to the timing ``name``."""
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def count(self, name, value=1, type_=None):
+        """Add ``value`` to the counter ``name`` for the resource ``type_``."""
+        key = (name, type_)
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def report(self, instrumentation):
+        """Report all timings and counters to the ``instrumentation``.
+
+        :param instrumentation: The instrumentation to report to
+        :type instrumentation: :class:`~compound_jsonapi.instrumentation.Instrumentation`
+        """
+        for name, seconds in self.timings.items():
+            instrumentation.timing(name, seconds)
+        for (name, type_), value in self.counts.items():
+            instrumentation.count(name, value, {'type': type_} if type_ is not None else None)
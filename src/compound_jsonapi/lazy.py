@@ -0,0 +1,186 @@
+"""
+:mod:`compound_jsonapi.lazy`
+============================
+
+Provides the :class:`~compound_jsonapi.lazy.LazyDocument` and the
+:class:`~compound_jsonapi.lazy.LazyResource` proxies that are used by
+:func:`~compound_jsonapi.schema.Schema.load` with ``lazy=True``. Instead of
+deserialising all included resources up front, the relationships of the
+deserialised objects are set to :class:`~compound_jsonapi.lazy.LazyResource`
+proxies, which deserialise the included resource they refer to the first time
+they are accessed. Each included resource is deserialised at most once, so
+circular relationships resolve to the same object.
+
+As the included resources are validated when they are accessed, any errors are
+raised as a :class:`~marshmallow.ValidationError` at that point.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import marshmallow as ma
+import operator
+import threading
+
+_EMPTY = {}
+
+
+def resolve(value):
+    """Return the object that the ``value`` refers to, deserialising it if the
+    ``value`` is a :class:`~compound_jsonapi.lazy.LazyResource`. ``list``\\ s
+    are resolved item by item."""
+    if isinstance(value, LazyResource):
+        return value._resolve()
+    elif isinstance(value, list):
+        return [resolve(part) for part in value]
+    return value
+
+
+class LazyDocument(object):
+    """Holds the included resources of a compound JSONAPI document that is
+    loaded lazily, together with the objects that have already been
+    deserialised."""
+
+    def __init__(self, schema, primary, included, identity_map=None):
+        """
+        :param schema: The root :class:`~compound_jsonapi.schema.Schema`
+        :type schema: :class:`~compound_jsonapi.schema.Schema`
+        :param primary: The primary resource objects and their deserialised
+                        objects, whose relationships are linked
+        :type primary: ``list`` of ``(resource, obj)`` tuples
+        :param included: The included resource objects that can be deserialised
+        :type included: ``list``
+        :param identity_map: The objects loaded by earlier loads, which are
+                             used instead of deserialising the included resources
+        :type identity_map: :class:`~compound_jsonapi.identity.IdentityMap`
+        """
+        self.schema = schema
+        self.identity_map = identity_map
+        self._sources = dict([((resource['type'], resource['id']), resource) for resource in included])
+        self._loaded = dict([((resource['type'], resource['id']), obj) for resource, obj in primary])
+        self._proxies = {}
+        self._lock = threading.RLock()
+        for resource, obj in primary:
+            self.link(schema.load_schemas[resource['type']], resource, obj)
+
+    def get(self, key):
+        """Return the object for the ``(type, id)`` ``key`` if it has already been
+        deserialised, otherwise a :class:`~compound_jsonapi.lazy.LazyResource`
+        for it. If the object is in the ``identity_map``, that object is
+        returned. Returns ``None`` if the ``key`` is not in the document."""
+        obj = self._loaded.get(key)
+        if obj is not None:
+            return obj
+        if self.identity_map is not None:
+            obj = self.identity_map.get(key)
+            if obj is not None:
+                return obj
+        if key not in self._sources:
+            return None
+        proxy = self._proxies.get(key)
+        if proxy is None:
+            proxy = self._proxies.setdefault(key, LazyResource(self, key))
+        return proxy
+
+    def resolve(self, key):
+        """Return the object for the ``(type, id)`` ``key``, deserialising it and
+        linking its relationships if that has not been done yet.
+
+        :raises ValidationError: If the included resource is not valid
+        """
+        obj = self._loaded.get(key)
+        if obj is None:
+            with self._lock:
+                obj = self._loaded.get(key)
+                if obj is None:
+                    schema = self.schema.load_schemas[key[0]]
+                    resource = self._sources[key]
+                    loaded, errors = schema._load_included([resource])
+                    if errors:
+                        raise ma.ValidationError({'included': {key[0]: errors}})
+                    obj = loaded[0]
+                    self._loaded[key] = obj
+                    self.link(schema, resource, obj)
+                    if self.identity_map is not None:
+                        self.identity_map.update([(key, obj)])
+        return obj
+
+    def link(self, schema, resource, obj):
+        """Set the relationships of the deserialised ``obj`` to the objects or
+        :class:`~compound_jsonapi.lazy.LazyResource` proxies they link to. Links
+        to resources that are not in the document are handled as by
+        :func:`~compound_jsonapi.schema.Schema.load`."""
+        relationships = resource.get('relationships', _EMPTY)
+        if isinstance(obj, dict):
+            setter, set_empty = operator.setitem, True
+        else:
+            setter, set_empty = setattr, False
+        for field_name, field, to_many in schema.relationship_fields():
+            links = field.deserialize(relationships[field_name]['data']) if field_name in relationships else None
+            if links and to_many:
+                targets = [self.get(link) for link in links]
+                setter(obj, field_name, [target for target in targets if target is not None])
+            elif links:
+                target = self.get(links)
+                if target is None and set_empty:
+                    target = {}
+                setter(obj, field_name, target)
+            elif set_empty:
+                setter(obj, field_name, [] if to_many else {})
+
+
+class LazyResource(object):
+    """Proxy for an included resource that is deserialised when the proxy is
+    first used. Attribute access, item access, iteration, length, comparison,
+    and hashing are passed on to the deserialised object. Use
+    :func:`~compound_jsonapi.lazy.resolve` to get the deserialised object
+    itself, for example for ``isinstance`` checks."""
+    __slots__ = ('_document', '_key')
+
+    def __init__(self, document, key):
+        object.__setattr__(self, '_document', document)
+        object.__setattr__(self, '_key', key)
+
+    @property
+    def resource_type(self):
+        """The type of the resource, available without deserialising it."""
+        return self._key[0]
+
+    @property
+    def resource_id(self):
+        """The id of the resource, available without deserialising it."""
+        return self._key[1]
+
+    def _resolve(self):
+        return self._document.resolve(self._key)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __setitem__(self, key, value):
+        self._resolve()[key] = value
+
+    def __contains__(self, key):
+        return key in self._resolve()
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __eq__(self, other):
+        return self._resolve() == resolve(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __repr__(self):
+        return '<LazyResource({0}, {1})>'.format(self._key[0], self._key[1])
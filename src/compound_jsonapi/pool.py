@@ -0,0 +1,111 @@
+"""
+:mod:`compound_jsonapi.pool`
+============================
+
+Provides a process-wide pool of :class:`~compound_jsonapi.schema.Schema`
+instances. Instantiating a :class:`~marshmallow.Schema` copies and binds all
+of its fields, so instead of creating the related and included schemas for
+every root :class:`~compound_jsonapi.schema.Schema`, a single shared instance
+is created per schema class and set of options.
+
+The shared instances are used by concurrent dumps and loads. marshmallow keeps
+the errors of the dump or load in progress on the schema instance, which the
+:class:`~compound_jsonapi.schema.Schema` therefore keeps separately for each
+thread.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import threading
+
+from collections import OrderedDict
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+_lock = threading.Lock()
+_instances = OrderedDict()
+
+#: The maximum number of shared instances, and of compiled
+#: :class:`~compound_jsonapi.graph.SchemaNode`\ s, to keep. Once it is reached,
+#: the least recently used ones are removed.
+max_size = 1000
+
+
+def _freeze(value):
+    """Convert the option ``value`` into a hashable value."""
+    if isinstance(value, dict):
+        return tuple(sorted([(key, _freeze(item)) for key, item in value.items()]))
+    elif isinstance(value, (set, frozenset)):
+        return frozenset([_freeze(item) for item in value])
+    elif isinstance(value, (list, tuple)):
+        return tuple([_freeze(item) for item in value])
+    else:
+        return value
+
+
+def get_schema(schema_class, **options):
+    """Return the shared instance of the ``schema_class`` for the given
+    ``options``, creating it on first use. As the instance is shared, it must
+    not be modified after it has been returned. Once the pool holds
+    ``max_size`` instances, the least recently used instance is removed.
+
+    :param schema_class: The :class:`~compound_jsonapi.schema.Schema` class
+    :param options: The keyword arguments to instantiate the ``schema_class`` with
+    :return: The shared instance
+    :rtype: :class:`~compound_jsonapi.schema.Schema`
+    """
+    key = (schema_class, _freeze(options))
+    with _lock:
+        schema = _instances.get(key)
+        if schema is None:
+            schema = schema_class(**options)
+            _instances[key] = schema
+            while len(_instances) > max_size:
+                _instances.popitem(last=False)
+        else:
+            _instances.move_to_end(key)
+    return schema
+
+
+def clear():
+    """Remove all shared instances from the pool, together with the compiled
+    :class:`~compound_jsonapi.graph.SchemaNode`\ s that use them."""
+    from . import graph
+    with _lock:
+        _instances.clear()
+    graph.clear()
+
+
+class SchemaMap(Mapping):
+    """Read-only mapping of resource types to
+    :class:`~compound_jsonapi.schema.Schema` instances. The instances are only
+    fetched from the pool when they are first accessed, so checking whether a
+    type is included does not instantiate anything.
+    """
+
+    def __init__(self, schema_classes, schemas=None):
+        """
+        :param schema_classes: The :class:`~compound_jsonapi.schema.Schema`
+                               classes to map by their ``Meta.type_``
+        :param schemas: Additional already instantiated
+                        :class:`~compound_jsonapi.schema.Schema`\\ s to map
+        """
+        self._classes = dict([(schema_class.Meta.type_, schema_class) for schema_class in schema_classes or ()])
+        self._schemas = dict([(schema.Meta.type_, schema) for schema in schemas or ()])
+
+    def __contains__(self, type_):
+        return type_ in self._schemas or type_ in self._classes
+
+    def __getitem__(self, type_):
+        schema = self._schemas.get(type_)
+        if schema is None:
+            schema = get_schema(self._classes[type_])
+        return schema
+
+    def __iter__(self):
+        return iter(set(self._classes) | set(self._schemas))
+
+    def __len__(self):
+        return len(set(self._classes) | set(self._schemas))
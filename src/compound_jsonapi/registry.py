@@ -0,0 +1,55 @@
+"""
+:mod:`compound_jsonapi.registry`
+================================
+
+Provides the :class:`~compound_jsonapi.registry.ResourceRegistry` that keeps
+track of which resources have already been seen while serialising a compound
+JSONAPI document.
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+
+
+class ResourceRegistry(object):
+    """The :class:`~compound_jsonapi.registry.ResourceRegistry` combines a
+    hash-indexed set of visited ``(type, id)`` keys with the ``list`` of the
+    serialised included resources. A single registry is shared by all
+    :class:`~compound_jsonapi.schema.Schema` involved in one dump, so that
+    both the circular structure check and the de-duplication of the included
+    resources take constant time per resource.
+    """
+
+    def __init__(self):
+        self._visited = set()
+        self._included = []
+
+    def __contains__(self, key):
+        """Check whether the ``(type, id)`` ``key`` has already been visited."""
+        return key in self._visited
+
+    def __len__(self):
+        """Return the number of visited resources."""
+        return len(self._visited)
+
+    def visit(self, key):
+        """Mark the ``(type, id)`` ``key`` as visited.
+
+        :return: ``True`` if the ``key`` had not been visited before, ``False``
+                 otherwise
+        :rtype: ``bool``
+        """
+        if key in self._visited:
+            return False
+        self._visited.add(key)
+        return True
+
+    def include(self, key, data):
+        """Add the serialised ``data`` for the ``(type, id)`` ``key`` to the
+        included resources. The included resources are returned in the order in
+        which they were added. As only resources that have not been visited
+        before are serialised, each ``key`` is only included once."""
+        self._included.append(data)
+
+    def included(self):
+        """Return the ``list`` of included resources."""
+        return list(self._included)
@@ -8,16 +8,128 @@ custom schemas to use for serialisation / deserialisation.
 .. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
 """
 import marshmallow as ma
+import operator
+import threading
 
-from marshmallow import pre_load, pre_dump, post_dump
+from collections import OrderedDict
+from itertools import repeat
+from marshmallow import marshalling, pre_load, post_dump
+from timeit import default_timer as timer
 
+from . import encoding
+from .context import DumpContext
 from .fields import Relationship
+from .graph import compile_schema
+from .instrumentation import Stats
+from .lazy import LazyDocument
+from .pool import SchemaMap
+from .stream import iter_resources
+
+_PENDING = object()
+_EMPTY = {}
+_DICT_SETTER = (operator.setitem, True)
+_OBJECT_SETTER = (setattr, False)
+
+
+def _chunks(iterable, size):
+    """Split the ``iterable`` into ``list``\ s of at most ``size`` items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load_chunk(schema_class, part_sources):
+    """Deserialise a chunk of included ``part_sources`` with a new instance of
+    the ``schema_class``. Used to deserialise included resources on an executor.
+
+    :return: A tuple of the form (``data``, ``errors``)
+    """
+    return schema_class()._load_included(part_sources)
+
+
+def _columns(columns, names=None):
+    """Return the ``dict`` of columns by attribute name. If ``names`` are given,
+    the ``columns`` are rows that are split into one column per name. NumPy
+    arrays are converted into ``list``\ s of Python values."""
+    if names is not None:
+        rows = list(zip(*columns))
+        columns = dict(zip(names, rows if rows else [()] * len(names)))
+    return dict([(name, values.tolist() if hasattr(values, 'tolist') else values)
+                 for name, values in columns.items()])
+
+
+def _column_value(obj, attr, default):
+    """Accessor for serialising a single column value, which is passed as the
+    ``obj`` itself."""
+    return obj
+
+
+def _fieldsets(fields):
+    """Normalise the sparse ``fields`` into a ``dict`` of ``frozenset``\ s of
+    field names by resource type. Comma-separated ``str`` values are split."""
+    if fields is None:
+        return None
+    result = {}
+    for type_, names in fields.items():
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(',')]
+        result[type_] = frozenset([name for name in names if name])
+    return result
+
+
+def _include_paths(include):
+    """Parse the ``include`` relationship paths into a tree of nested ``dict``\ s
+    keyed by relationship name."""
+    if include is None:
+        return None
+    if isinstance(include, str):
+        include = include.split(',')
+    tree = {}
+    for path in include:
+        subtree = tree
+        for name in path.strip().split('.'):
+            if name:
+                subtree = subtree.setdefault(name, {})
+    return tree
+
+
+def _reuse(objs, identity_map, links, failed):
+    """Add the objects for those ``links`` that are not in ``objs``, but in the
+    ``identity_map``, to ``objs``. Links to resources that ``failed`` to
+    validate are not resolved."""
+    for link in links:
+        if link not in objs and link not in failed:
+            part_loaded = identity_map.get(link)
+            if part_loaded is not None:
+                objs[link] = (None, part_loaded)
+
+
+def _setter(obj):
+    """Return the strategy for setting the relationships of the deserialised
+    ``obj`` as a tuple ``(setter, set_empty)``. The ``setter`` is called with the
+    ``obj``, the field name, and the value. Empty relationships are only set if
+    ``set_empty`` is ``True``, which is the case for ``dict``\ s."""
+    if isinstance(obj, dict):
+        return _DICT_SETTER
+    else:
+        return _OBJECT_SETTER
 
 
 class Schema(ma.Schema):
     """Extends the :class:`~marshmallow.Schema` with the functionality needed
     for serialising to / deserialising from compound JSONAPI documents."""
 
+    #: The :class:`~compound_jsonapi.instrumentation.Instrumentation` that
+    #: receives the timings and counters of each dump and load
+    instrumentation = None
+    #: The :class:`~compound_jsonapi.cache.ResourceCache` for the included resources
+    cache = None
+
     def __init__(self, include_schemas=None, *args, **kwargs):
         """
         When instantiating a :class:`~compound_jsonapi.schema.Schema`, by default
@@ -25,111 +137,824 @@ class Schema(ma.Schema):
         are to be followed, then the :class:`~compound_jsonapi.schema.Schema`\ s
         that are to be included must be listed in ``include_schemas``.
 
+        The included :class:`~compound_jsonapi.schema.Schema`\ s are only
+        instantiated when they are first needed and are then shared via the
+        :mod:`~compound_jsonapi.pool`.
+
+        The ``fields`` restrict the attributes and relationships that are
+        serialised per resource type, as for JSONAPI's ``fields[type]`` sparse
+        fieldsets. Each value is either a list of names or a comma-separated
+        ``str``. Names are matched against the serialised name of each field and
+        the id is always included. The ``fields`` apply to this
+        :class:`~compound_jsonapi.schema.Schema` and to all related
+        :class:`~compound_jsonapi.schema.Schema`\ s, which are instantiated and
+        shared separately for every distinct ``fields`` value, after unknown
+        types and field names have been removed. Relationships that are not
+        listed are not serialised, so their resources are not included.
+
+        The ``include`` restricts the included resources to the given
+        relationship paths, as for JSONAPI's ``include`` parameter. It is either a
+        list of dot-separated paths or a comma-separated ``str`` of paths, such as
+        ``'comments.author,author'``. Relationships are only followed along these
+        paths and only as deep as the paths go. Resource linkage is still
+        serialised for all relationships to included types. If ``include`` is
+        not given, all relationships to included types are followed.
+
+        The ``fields``, ``include``, ``instrumentation``, and ``cache`` can only
+        be given as keyword arguments, so that any further positional arguments
+        are passed on to the :class:`~marshmallow.Schema`.
+
         :param include_schemas: The :class:`~compound_jsonapi.schema.Schema`\ s to
                                 include when serialising / deserialising
         :type include_schemas: ``list`` of :class:`~compound_jsonapi.schema.Schema`
+        :param fields: The names of the fields to serialise by resource type
+        :type fields: ``dict``
+        :param include: The relationship paths to include
+        :type include: ``str`` or ``list`` of ``str``
+        :param instrumentation: Receives the timings and counters of each dump
+                                and load. Defaults to the class's
+                                ``instrumentation``, which is ``None``
+        :type instrumentation: :class:`~compound_jsonapi.instrumentation.Instrumentation`
+        :param cache: Caches the included resource objects across dumps. Defaults
+                      to the class's ``cache``, which is ``None``
+        :type cache: :class:`~compound_jsonapi.cache.ResourceCache`
         """
+        fields = kwargs.pop('fields', None)
+        include = kwargs.pop('include', None)
+        instrumentation = kwargs.pop('instrumentation', None)
+        cache = kwargs.pop('cache', None)
+        self.fieldsets = _fieldsets(fields)
+        self.include_paths = _include_paths(include)
+        if instrumentation is not None:
+            self.instrumentation = instrumentation
+        if cache is not None:
+            self.cache = cache
+        if self.fieldsets is not None and self.Meta.type_ in self.fieldsets and args:
+            args = (self._sparse_only(self.fieldsets[self.Meta.type_], args[0]),) + tuple(args[1:])
+        elif self.fieldsets is not None and self.Meta.type_ in self.fieldsets:
+            kwargs['only'] = self._sparse_only(self.fieldsets[self.Meta.type_], kwargs.get('only'))
+        self._local = threading.local()
         super(Schema, self).__init__(*args, **kwargs)
-        self.include_schemas = dict([(s.Meta.type_, s()) for s in include_schemas]) if include_schemas else {}
-        self.load_schemas = dict([(s.Meta.type_, s()) for s in include_schemas]) if include_schemas else {}
-        self.load_schemas[self.Meta.type_] = self
-
-    def _unwrap_single(self, data):
-        """Unwrap a single JSONAPI object. Merges the id, and all attributes
-        and relationship values into a single ``dict``."""
-        data = data['data']
-        result = {'id': data['id']}
-        if 'attributes' in data:
-            result.update(data['attributes'])
-        if 'relationships' in data:
-            for key, value in data['relationships'].items():
-                if 'data' in value:
-                    result[key] = value['data']
-        return result
+        self.include_schemas = SchemaMap(include_schemas)
+        self.load_schemas = SchemaMap(include_schemas, [self])
+        self._node = None
+        self._relationship_fields = None
+        self._wrap_resource = None
+        self._unwrap_resource = None
+        self._identify = None
+
+    @property
+    def _marshal(self):
+        """The :class:`~marshmallow.marshalling.Marshaller` of the current thread.
+        The marshaller holds the errors of the dump that is in progress, so each
+        thread uses its own and a single instance can be shared between threads."""
+        marshal = getattr(self._local, 'marshal', None)
+        if marshal is None:
+            marshal = marshalling.Marshaller(prefix=self.prefix)
+            self._local.marshal = marshal
+        return marshal
+
+    @_marshal.setter
+    def _marshal(self, value):
+        self._local.marshal = value
+
+    @property
+    def _unmarshal(self):
+        """The :class:`~marshmallow.marshalling.Unmarshaller` of the current
+        thread, which holds the errors of the load that is in progress."""
+        unmarshal = getattr(self._local, 'unmarshal', None)
+        if unmarshal is None:
+            unmarshal = marshalling.Unmarshaller()
+            self._local.unmarshal = unmarshal
+        return unmarshal
+
+    @_unmarshal.setter
+    def _unmarshal(self, value):
+        self._local.unmarshal = value
+
+    @classmethod
+    def _sparse_only(cls, names, only=None):
+        """Return the names of the declared fields whose serialised name is in
+        ``names``, plus the ``Meta.id_attr`` field, for use as the ``only``
+        parameter. If ``only`` is given, the result is restricted to it."""
+        id_attr = getattr(cls.Meta, 'id_attr', 'id')
+        result = set([field_name for field_name, field in cls._declared_fields.items()
+                      if field_name == id_attr or (field.dump_to or field_name) in names])
+        if only:
+            result = result & set(only)
+        return tuple(sorted(result))
+
+    def relationship_fields(self):
+        """Return the :class:`~compound_jsonapi.fields.Relationship` fields of this
+        :class:`~compound_jsonapi.schema.Schema`. The list is only built once.
+
+        :return: ``tuple`` of ``(field_name, relationship, many)`` tuples
+        """
+        if self._relationship_fields is None:
+            self._relationship_fields = tuple([(field_name, field, field.many)
+                                               for field_name, field in self.fields.items()
+                                               if isinstance(field, Relationship)])
+        return self._relationship_fields
+
+    def _identifier(self):
+        """Return the function that extracts the JSONAPI id of an object as a
+        ``str``. If the ``Meta`` defines an ``id_getter``, then that is called
+        with the object. Otherwise the id is read from the ``Meta.id_attr``
+        attribute (default ``'id'``). Unless ``get_attribute`` has been
+        overridden, plain attribute names are read directly, without going
+        through marshmallow's attribute lookup. The function is built once per
+        :class:`~compound_jsonapi.schema.Schema`."""
+        if self._identify is None:
+            id_getter = getattr(self.Meta, 'id_getter', None)
+            id_attr = getattr(self.Meta, 'id_attr', 'id')
+            if id_getter is not None:
+                def identify(obj):
+                    return str(id_getter(obj))
+            elif type(self).get_attribute is ma.Schema.get_attribute and '.' not in id_attr:
+                get_attribute = self.get_attribute
+
+                def identify(obj):
+                    if isinstance(obj, dict):
+                        return str(obj.get(id_attr))
+                    value = getattr(obj, id_attr, _PENDING)
+                    if value is _PENDING:
+                        value = get_attribute(obj, id_attr, None)
+                    return str(value)
+            else:
+                get_attribute = self.get_attribute
+
+                def identify(obj):
+                    return str(get_attribute(obj, id_attr, None))
+            self._identify = identify
+        return self._identify
+
+    def compile(self):
+        """Compile the graph of related :class:`~compound_jsonapi.schema.Schema`\ s.
+        Resolves the :class:`~compound_jsonapi.schema.Schema` of every
+        :class:`~compound_jsonapi.fields.Relationship` that can be reached from
+        this :class:`~compound_jsonapi.schema.Schema`, whether it is given as a
+        class, a class name, or ``'self'``. This is done automatically on the
+        first call to :func:`~compound_jsonapi.schema.Schema.dump`, but can be
+        called explicitly to pay the cost at application startup. Also builds the
+        functions that wrap and unwrap the resource objects of all schemas in
+        the graph.
+
+        :return: The root node of the compiled graph
+        :rtype: :class:`~compound_jsonapi.graph.SchemaNode`
+        """
+        if self._node is None:
+            node = compile_schema(self)
+            for schema in [node.schema] + [other.schema for other in node.reachable]:
+                schema._wrapper()
+                schema._unwrapper()
+            self._node = node
+        return self._node
+
+    def _unwrapper(self):
+        """Return the function that unwraps a single JSONAPI resource object
+        into a single ``dict`` by merging the id, and all attributes and
+        relationship values. The function is built once per
+        :class:`~compound_jsonapi.schema.Schema` and only looks at the
+        relationships that are defined by the schema."""
+        if self._unwrap_resource is None:
+            relationship_keys = tuple([field.load_from or field_name
+                                       for field_name, field, _ in self.relationship_fields()])
+            id_key = self._id_key('load_from')
+
+            def unwrap(resource):
+                result = dict(resource['attributes']) if 'attributes' in resource else {}
+                result[id_key] = resource['id']
+                relationships = resource.get('relationships')
+                if relationships:
+                    for key in relationship_keys:
+                        value = relationships.get(key)
+                        if value is not None and 'data' in value:
+                            result[key] = value['data']
+                return result
+            self._unwrap_resource = unwrap
+        return self._unwrap_resource
+
+    def _id_key(self, option):
+        """Return the key that holds the id in the serialised ``dict``. This is
+        the ``Meta.id_attr`` (default ``'id'``), unless the field's ``option``
+        (``dump_to`` or ``load_from``) is set."""
+        id_attr = getattr(self.Meta, 'id_attr', 'id')
+        if id_attr in self.fields:
+            return getattr(self.fields[id_attr], option) or id_attr
+        return id_attr
 
     @pre_load(pass_many=True)
     def _unwrap(self, data, many):
         """Unwrap all the objects that are to be deserialised."""
+        unwrap = self._unwrapper()
         if many:
-            return [self._unwrap_single({'data': part}) for part in data['data']]
+            return [unwrap(part) for part in data['data']]
         else:
-            return self._unwrap_single(data)
+            return unwrap(data['data'])
+
+    def load(self, data, many=None, partial=None, executor=None, chunk_size=100, lazy=False, identity_map=None):
+        """Deserialise the compound JSONAPI document ``data``. See
+        :meth:`~marshmallow.Schema.load` for the basic parameters.
+
+        If an ``executor`` is given, the included resources are split into chunks
+        of ``chunk_size`` resources of the same type, which are deserialised
+        concurrently on the ``executor``. Each chunk is deserialised with a new
+        instance of the included :class:`~compound_jsonapi.schema.Schema`\ 's
+        class, so for a process pool the schema classes and the deserialised
+        objects must be picklable. The relationships are linked once all chunks
+        have been deserialised.
 
-    def _do_load(self, data, many=None, partial=None, postprocess=True):
+        If ``lazy`` is set, only the primary data is deserialised and its
+        relationships are set to :class:`~compound_jsonapi.lazy.LazyResource`
+        proxies, which deserialise the included resources when they are first
+        accessed. Errors in the included resources are then raised when they
+        are accessed.
+
+        If an ``identity_map`` is given, included resources that have already
+        been loaded into it are not deserialised again, links to resources that
+        are not in the document are resolved from it, and all deserialised
+        objects are added to it (see :mod:`~compound_jsonapi.identity`).
+
+        :param executor: The optional executor to deserialise the included
+                         resources on
+        :type executor: :class:`~concurrent.futures.Executor`
+        :param chunk_size: The number of included resources per chunk
+        :type chunk_size: ``int``
+        :param lazy: Whether to deserialise the included resources lazily
+        :type lazy: ``bool``
+        :param identity_map: The objects loaded by earlier loads
+        :type identity_map: :class:`~compound_jsonapi.identity.IdentityMap`
+        :return: A tuple of the form (``data``, ``errors``)
+        :rtype: :class:`~marshmallow.UnmarshalResult`
+        """
+        result, errors = self._do_load(data, many, partial=partial, postprocess=True, executor=executor,
+                                       chunk_size=chunk_size, lazy=lazy, identity_map=identity_map)
+        return ma.UnmarshalResult(result, errors)
+
+    def loads_bytes(self, json_data, many=None, *args, **kwargs):
+        """Deserialise the compound JSONAPI document ``json_data``, which is
+        either UTF-8 encoded ``bytes`` or a ``str``. The document is decoded with
+        the fastest available :mod:`~compound_jsonapi.encoding` backend instead of
+        the ``render_module`` used by ``loads``. See
+        :func:`~compound_jsonapi.schema.Schema.load` for the other parameters."""
+        return self.load(encoding.loads(json_data), many, *args, **kwargs)
+
+    def _do_load(self, data, many=None, partial=None, postprocess=True, executor=None, chunk_size=100,
+                 lazy=False, identity_map=None):
         """Override the :class:`~marshmallow.Schema`\ 's ``_do_load`` to correctly
-        handle the included data."""
+        handle the included data. The included data is deserialised in one batch
+        per type, or in chunks on the ``executor`` if one is given, and any errors
+        are reported by type and id under the ``included`` key. Included
+        resources that fail to validate are not linked. Links to
+        resources that are not included are left out of to-many relationships,
+        while to-one relationships are set to ``None``, or to an empty ``dict``
+        for ``dict`` data, as for empty relationships. If the ``instrumentation``
+        is set, the timings and counters of the load are reported to it. If
+        ``lazy`` is set, the included data is only deserialised when it is
+        accessed (see :mod:`~compound_jsonapi.lazy`). If an ``identity_map`` is
+        given, objects are re-used from it and the valid deserialised objects are
+        added to it (see :mod:`~compound_jsonapi.identity`)."""
         many = self.many if many is None else bool(many)
+        stats = Stats() if self.instrumentation is not None else None
+        if stats is not None:
+            started = timer()
         # Load the main data
         loaded, errors = super(Schema, self)._do_load(data, many=many, partial=partial, postprocess=postprocess)
+        if stats is not None:
+            stats.time('load.primary', timer() - started)
+            stats.count('load.resources', len(data['data']) if many else 1, self.Meta.type_)
+            started = timer()
         objs = {}
+        failed = set()
         if many:
-            for part_source, part_loaded in zip(data['data'], loaded):
-                objs[(part_source['type'], part_source['id'])] = ({'data': part_source}, part_loaded)
+            for idx, (part_source, part_loaded) in enumerate(zip(data['data'], loaded)):
+                objs[(part_source['type'], part_source['id'])] = (part_source, part_loaded)
+                if idx in errors:
+                    failed.add((part_source['type'], part_source['id']))
         else:
-            objs[(data['data']['type'], data['data']['id'])] = (data, loaded)
-        # Load the included data
+            objs[(data['data']['type'], data['data']['id'])] = (data['data'], loaded)
+            if errors:
+                failed.add((data['data']['type'], data['data']['id']))
+        if lazy:
+            LazyDocument(self, list(objs.values()),
+                         [part_source for part_source in data['included'] if part_source['type'] in self.load_schemas]
+                         if 'included' in data else [], identity_map=identity_map)
+            if identity_map is not None:
+                identity_map.update([(key, part_loaded) for key, (_, part_loaded) in objs.items()
+                                     if key not in failed])
+            if stats is not None:
+                stats.report(self.instrumentation)
+            return ma.UnmarshalResult(loaded, errors)
+        # Load the included data, re-using objects from the identity map
+        groups = OrderedDict()
         for part_source in data['included'] if 'included' in data else []:
             if part_source['type'] in self.load_schemas:
-                part_loaded, errors = super(Schema, self.load_schemas[part_source['type']]).\
-                    _do_load({'data': part_source}, many=False, partial=None, postprocess=True)
-                objs[(part_source['type'], part_source['id'])] = ({'data': part_source}, part_loaded)
-        # Fix the relationships
-        for part_source, part_loaded in objs.values():
-            schema = self.load_schemas[part_source['data']['type']]
-            for field_name, validator in schema.fields.items():
-                if isinstance(validator, Relationship):
-                    links = validator.deserialize(part_source['data']['relationships'][field_name]['data']
-                                                  if 'relationships' in part_source['data'] and
-                                                  field_name in part_source['data']['relationships'] else None)
-                    if validator.many:
-                        if isinstance(part_loaded, dict):
-                            part_loaded[field_name] = [objs[link][1] for link in links] if links else []
-                        else:
-                            setattr(part_loaded, field_name, [objs[link][1] for link in links]) if links else []
-                    else:
-                        if isinstance(part_loaded, dict):
-                            part_loaded[field_name] = objs[links][1] if links else {}
-                        else:
-                            setattr(part_loaded, field_name, objs[links][1]) if links else {}
+                if identity_map is not None:
+                    key = (part_source['type'], part_source['id'])
+                    part_loaded = identity_map.get(key) if key not in objs else None
+                    if part_loaded is not None:
+                        objs[key] = (None, part_loaded)
+                        if stats is not None:
+                            stats.count('load.reused', 1, key[0])
+                        continue
+                groups.setdefault(part_source['type'], []).append(part_source)
+        if executor is None:
+            results = [(type_, part_sources, self.load_schemas[type_]._load_included(part_sources))
+                       for type_, part_sources in groups.items()]
+        else:
+            futures = [(type_, chunk, executor.submit(_load_chunk, self.load_schemas[type_].__class__, chunk))
+                       for type_, part_sources in groups.items()
+                       for chunk in _chunks(part_sources, chunk_size)]
+            results = [(type_, chunk, future.result()) for type_, chunk, future in futures]
+        for type_, part_sources, (loaded_parts, included_errors) in results:
+            if included_errors:
+                errors.setdefault('included', {}).setdefault(type_, {}).update(included_errors)
+                failed.update([(type_, id_) for id_ in included_errors])
+            for part_source, part_loaded in zip(part_sources, loaded_parts):
+                if part_source['id'] not in included_errors:
+                    objs[(part_source['type'], part_source['id'])] = (part_source, part_loaded)
+        if stats is not None:
+            stats.time('load.included', timer() - started)
+            for type_, part_sources in groups.items():
+                stats.count('load.resources', len(part_sources), type_)
+            started = timer()
+        # Fix the relationships of the deserialised objects
+        for part_source, part_loaded in list(objs.values()):
+            if part_source is None:
+                continue
+            relationships = part_source.get('relationships', _EMPTY)
+            setter, set_empty = _setter(part_loaded)
+            for field_name, field, to_many in self.load_schemas[part_source['type']].relationship_fields():
+                links = field.deserialize(relationships[field_name]['data']) if field_name in relationships else None
+                if links and identity_map is not None:
+                    _reuse(objs, identity_map, links if to_many else [links], failed)
+                if links and to_many:
+                    setter(part_loaded, field_name, [objs[link][1] for link in links if link in objs])
+                elif links and links in objs:
+                    setter(part_loaded, field_name, objs[links][1])
+                elif links:
+                    setter(part_loaded, field_name, {} if set_empty else None)
+                elif set_empty:
+                    setter(part_loaded, field_name, [] if to_many else {})
+        if identity_map is not None:
+            identity_map.update([(key, part_loaded) for key, (part_source, part_loaded) in objs.items()
+                                 if part_source is not None and key not in failed])
+        if stats is not None:
+            stats.time('load.fixup', timer() - started)
+            stats.report(self.instrumentation)
         return ma.UnmarshalResult(loaded, errors)
 
-    @pre_dump(pass_many=True)
-    def _init_dump(self, data, many):
-        """Initialise the state variables for serialising data."""
-        if not hasattr(self, '_visited'):
-            setattr(self, '_visited', [])
-        if not hasattr(self, '_included_data'):
-            setattr(self, '_included_data', {})
-        if not hasattr(self, '_parent'):
-            if many:
-                self._visited.extend([(self.Meta.type_, str(self.get_attribute(part, 'id', None))) for part in data])
+    def _load_included(self, part_sources):
+        """Deserialise the included ``part_sources``, which all have this
+        :class:`~compound_jsonapi.schema.Schema`\ 's type, in a single call. If
+        any of them fail to validate, they are deserialised one at a time, so
+        that the post-load processing is still applied to the valid ones.
+
+        :return: A tuple of the form (``data``, ``errors``), where ``errors`` is
+                 keyed by resource id
+        """
+        loaded, errors = super(Schema, self)._do_load({'data': part_sources}, many=True, partial=None,
+                                                      postprocess=True)
+        if errors:
+            loaded = []
+            errors = {}
+            for part_source in part_sources:
+                part_loaded, part_errors = super(Schema, self)._do_load({'data': part_source}, many=False,
+                                                                        partial=None, postprocess=True)
+                loaded.append(part_loaded)
+                if part_errors:
+                    errors[part_source['id']] = part_errors
+        return loaded, errors
+
+    def load_stream(self, resources, many=None, partial=None):
+        """Deserialise a compound JSONAPI document that is provided one resource
+        at a time. Each resource is deserialised as soon as it arrives. Only the
+        deserialised objects and those relationship links whose target has not
+        yet arrived are kept, so that the source document never needs to be
+        held in memory. Links whose target never arrives are left out of to-many
+        relationships and to-one relationships are set as for ``load``. Included
+        resources that fail to validate are reported by type and id under the
+        ``included`` key and are not linked.
+
+        :param resources: The ``(section, resource)`` tuples to deserialise, where
+                          ``section`` is ``'data'`` for primary resources and
+                          ``'included'`` for included resources
+        :param many: Whether to deserialise a collection. If ``None``, the value
+                     for ``self.many`` is used
+        :type many: ``bool``
+        :param partial: Whether to ignore missing fields in the primary resources
+        :return: A tuple of the form (``data``, ``errors``)
+        :rtype: :class:`~marshmallow.UnmarshalResult`
+        """
+        many = self.many if many is None else bool(many)
+        primary = []
+        errors = {}
+        loaded = {}
+        waiting = {}
+        for section, resource in resources:
+            if section == 'data':
+                schema = self
+            elif resource['type'] in self.load_schemas:
+                schema = self.load_schemas[resource['type']]
             else:
-                self._visited.append((self.Meta.type_, str(self.get_attribute(data, 'id', None))))
-
-    def _wrap_single(self, data):
-        """Wrap a single object in the necessary JSONAPI properties."""
-        result = {'data': {'type': self.Meta.type_,
-                           'id': str(data['id']),
-                           'attributes': {},
-                           'relationships': {}}}
-        for key, value in data.items():
-            if key != 'id':
-                if isinstance(self.fields[key], Relationship):
-                    result['data']['relationships'][key] = {'data': value}
+                continue
+            part_loaded, part_errors = super(Schema, schema).\
+                _do_load({'data': resource}, many=False, partial=partial if section == 'data' else None,
+                         postprocess=True)
+            if section == 'data':
+                if part_errors and many:
+                    errors[len(primary)] = part_errors
+                elif part_errors:
+                    errors.update(part_errors)
+                primary.append(part_loaded)
+            elif part_errors:
+                errors.setdefault('included', {}).setdefault(resource['type'], {})[resource['id']] = part_errors
+                continue
+            relationships = resource.get('relationships', _EMPTY)
+            setter, set_empty = _setter(part_loaded)
+            for field_name, field, to_many in schema.relationship_fields():
+                links = field.deserialize(relationships[field_name]['data']) if field_name in relationships else None
+                if to_many and links:
+                    targets = [loaded.get(link, _PENDING) for link in links]
+                    setter(part_loaded, field_name, targets)
+                    for idx, target in enumerate(targets):
+                        if target is _PENDING:
+                            waiting.setdefault(links[idx], []).append((part_loaded, setter, field_name, targets, idx))
+                elif links and links in loaded:
+                    setter(part_loaded, field_name, loaded[links])
+                elif links:
+                    setter(part_loaded, field_name, {} if set_empty else None)
+                    waiting.setdefault(links, []).append((part_loaded, setter, field_name, None, None))
+                elif set_empty:
+                    setter(part_loaded, field_name, [] if to_many else {})
+            key = (resource['type'], resource['id'])
+            loaded[key] = part_loaded
+            for obj, setter, field_name, targets, idx in waiting.pop(key, []):
+                if targets is None:
+                    setter(obj, field_name, part_loaded)
                 else:
-                    result['data']['attributes'][key] = value
-        if not result['data']['attributes']:
-            del result['data']['attributes']
-        if not result['data']['relationships']:
-            del result['data']['relationships']
+                    targets[idx] = part_loaded
+        for entries in waiting.values():
+            for obj, setter, field_name, targets, idx in entries:
+                if targets is not None:
+                    targets[:] = [target for target in targets if target is not _PENDING]
+        if many:
+            return ma.UnmarshalResult(primary, errors)
+        else:
+            return ma.UnmarshalResult(primary[0] if primary else None, errors)
+
+    def load_from(self, fp, many=None, partial=None):
+        """Deserialise the compound JSONAPI document in the file-like object
+        ``fp``, reading the resources one at a time (see
+        :func:`~compound_jsonapi.stream.iter_resources`). See
+        :func:`~compound_jsonapi.schema.Schema.load_stream` for the parameters."""
+        return self.load_stream(iter_resources(fp), many=many, partial=partial)
+
+    def dump(self, obj, many=None, update_fields=True, **kwargs):
+        """Override the :class:`~marshmallow.Schema`\ 's ``dump`` to serialise
+        ``obj`` into a compound JSONAPI document. Each call creates a new
+        :class:`~compound_jsonapi.context.DumpContext`, which is used by all
+        :class:`~compound_jsonapi.fields.Relationship` to track and queue the
+        included resources, which are then serialised type by type by the
+        :class:`~compound_jsonapi.context.DumpContext`. Related
+        :class:`~compound_jsonapi.schema.Schema` are serialised within the
+        active :class:`~compound_jsonapi.context.DumpContext` via
+        :func:`~compound_jsonapi.schema.Schema.dump_resources`, so a call to
+        ``dump`` while another dump is in progress, for example from a
+        ``Method`` field, creates an independent document. Errors in the included
+        resources are reported by type under the ``included`` key. If the
+        ``instrumentation`` is set, the timings and counters of the dump are
+        reported to it."""
+        if self._node is None:
+            self.compile()
+        many = self.many if many is None else bool(many)
+        if many:
+            obj = list(obj)
+        instrumentation = self.instrumentation
+        with DumpContext(self) as context:
+            if instrumentation is not None:
+                context.stats = Stats()
+                started = timer()
+            node = self._node
+            for part in obj if many else [obj]:
+                context.visit_root(node, part)
+            context.prefetch([(node, part) for part in (obj if many else [obj])])
+            result = super(Schema, self).dump(obj, many=many, update_fields=update_fields, **kwargs)
+            if instrumentation is not None:
+                context.stats.time('dump.primary', timer() - started)
+                context.stats.count('dump.resources', len(obj) if many else 1, self.Meta.type_)
+            if result.data is not None:
+                errors = context.dump_included()
+                if errors:
+                    result.errors['included'] = errors
+                result.data['included'] = context.registry.included()
+        if instrumentation is not None:
+            context.stats.count('dump.included', len(context.registry.included()))
+            context.stats.report(instrumentation)
         return result
 
-    @post_dump(pass_many=True)
-    def _wrap(self, data, many):
-        """Wrap the response in the full JSONAPI structure."""
+    def dump_resources(self, obj, many=None):
+        """Serialise ``obj`` into JSONAPI resource objects within the active
+        :class:`~compound_jsonapi.context.DumpContext`, which tracks and queues
+        the related objects. Used by the
+        :class:`~compound_jsonapi.context.DumpContext` to serialise the included
+        resources of the document that is being dumped.
+
+        :return: A tuple of the form (``data``, ``errors``), where ``data`` only
+                 holds the ``data`` key
+        :rtype: :class:`~marshmallow.MarshalResult`
+        """
+        return super(Schema, self).dump(obj, many=many)
+
+    def dump_async(self, obj, many=None):
+        """Serialise ``obj`` into a compound JSONAPI document, where ``obj`` and
+        the values of its relationships can be awaitables. The relationship
+        values of each level of the object graph are resolved concurrently
+        before the level is serialised, so that the result is the same as for
+        :func:`~compound_jsonapi.schema.Schema.dump` (see
+        :mod:`~compound_jsonapi.aio`). Requires Python 3.5 or later.
+
+        :param obj: The object(s) to serialise
+        :param many: Whether to serialise ``obj`` as a collection. If ``None``,
+                     the value for ``self.many`` is used
+        :type many: ``bool``
+        :return: Awaitable returning a tuple of the form (``data``, ``errors``)
+        """
+        from .aio import dump_async
+        return dump_async(self, obj, many=many)
+
+    def dumps_bytes(self, obj, many=None, update_fields=True, **kwargs):
+        """Serialise ``obj`` into a compound JSONAPI document that is encoded as
+        UTF-8 JSON ``bytes`` with the fastest available
+        :mod:`~compound_jsonapi.encoding` backend, skipping the intermediate
+        ``str``. See :func:`~compound_jsonapi.schema.Schema.dump` for the
+        parameters.
+
+        :return: A tuple of the form (``data``, ``errors``)
+        :rtype: :class:`~marshmallow.MarshalResult`
+        """
+        data, errors = self.dump(obj, many=many, update_fields=update_fields, **kwargs)
+        return ma.MarshalResult(encoding.dumps(data), errors)
+
+    def dump_iter(self, obj, many=None, chunk_size=100):
+        """Serialise ``obj`` into a compound JSONAPI document that is returned as
+        a sequence of JSON fragments. The primary resources are serialised
+        ``chunk_size`` objects at a time and are yielded before any of the
+        included resources. The included resources are yielded one batch at a
+        time and only their ``(type, id)`` keys are kept to remove duplicates.
+        If ``many`` is set, ``obj`` can be any iterable, including a generator.
+
+        As the fragments may already have been sent, any errors are raised as a
+        :class:`~marshmallow.ValidationError` instead of being returned.
+
+        :param obj: The object(s) to serialise
+        :param many: Whether to serialise ``obj`` as a collection. If ``None``,
+                     the value for ``self.many`` is used
+        :type many: ``bool``
+        :param chunk_size: The number of primary resources to serialise at a time
+        :type chunk_size: ``int``
+        :return: Generator yielding the ``str`` JSON fragments
+        """
+        if self._node is None:
+            self.compile()
+        many = self.many if many is None else bool(many)
+        encode = self.opts.render_module.dumps
+        context = DumpContext(self)
+        primary = set()
         if many:
-            result = {'data': [self._wrap_single(part)['data'] for part in data]}
+            yield '{"data": ['
+            first = True
+            for chunk in _chunks(obj, chunk_size):
+                fragment = self._dump_primary(context, primary, chunk, True)
+                if fragment:
+                    yield fragment if first else ', ' + fragment
+                    first = False
+            yield '], "included": ['
         else:
-            result = self._wrap_single(data)
-        result['included'] = list(getattr(self, '_included_data').values())
+            yield '{"data": ' + self._dump_primary(context, primary, obj, False) + ', "included": ['
+        first = True
+        for batch in context.iter_included():
+            fragment = ', '.join([encode(resource) for key, resource in batch if key not in primary])
+            if fragment:
+                yield fragment if first else ', ' + fragment
+                first = False
+        if context.errors:
+            raise ma.ValidationError({'included': context.errors})
+        yield ']}'
+
+    def dump_to(self, obj, fp, many=None, chunk_size=100):
+        """Serialise ``obj`` into a compound JSONAPI document that is written
+        to the file-like object ``fp`` as it is generated. See
+        :func:`~compound_jsonapi.schema.Schema.dump_iter` for the parameters."""
+        for fragment in self.dump_iter(obj, many=many, chunk_size=chunk_size):
+            fp.write(fragment)
+
+    def dump_columns(self, columns, names=None):
+        """Serialise a collection of resources that is given by column instead
+        of by object into a compound JSONAPI document. ``columns`` maps the
+        attribute name of each field to the sequence of its values, such as a
+        ``list`` or a NumPy array. Alternatively ``columns`` is a sequence of rows,
+        such as the rows returned by a DB cursor, and ``names`` lists the
+        attribute name of each value in the rows.
+
+        Each field is serialised for the whole column at once, without any
+        per-object attribute lookups. The column of a
+        :class:`~compound_jsonapi.fields.Relationship` holds the id(s) of the
+        related objects, such as a foreign-key column, from which the resource
+        linkage is serialised without accessing the related objects. The related
+        resources are therefore not included. Fields whose column is missing are
+        left out, unless they have a ``default``, which for a
+        :class:`~compound_jsonapi.fields.Relationship` is the id(s) of the
+        related objects. The id is read from the
+        ``Meta.id_attr`` column. A ``Meta.id_getter`` is not supported, as it
+        requires the object.
+        ``pre_dump`` and ``post_dump`` methods are not called.
+
+        :param columns: The values by attribute name, or the rows if ``names`` is
+                        given
+        :type columns: ``dict`` or ``list``
+        :param names: The attribute names of the values in each row
+        :type names: ``list`` of ``str``
+        :return: A tuple of the form (``data``, ``errors``)
+        :rtype: :class:`~marshmallow.MarshalResult`
+        :raises ValueError: If the columns do not all have the same length, the
+                            id column is missing, the ``Meta`` defines an
+                            ``id_getter``, or a field needs the object
+        """
+        if self._node is None:
+            self.compile()
+        if getattr(self.Meta, 'id_getter', None) is not None:
+            raise ValueError('The Meta.id_getter cannot be used with columns')
+        columns = _columns(columns, names)
+        lengths = set([len(values) for values in columns.values()])
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length')
+        count = lengths.pop() if lengths else 0
+        id_attr = getattr(self.Meta, 'id_attr', 'id')
+        ids = columns.get(id_attr)
+        attributes = []
+        relationships = []
+        errors = {}
+        instrumentation = self.instrumentation
+        with DumpContext(self) as context:
+            if instrumentation is not None:
+                context.stats = Stats()
+                started = timer()
+            for field_name, field in self.fields.items():
+                if field.load_only or field_name == id_attr:
+                    continue
+                if isinstance(field, (ma.fields.Method, ma.fields.Function)):
+                    raise ValueError('The {0} field cannot be serialised from columns'.format(field_name))
+                key = field.dump_to or field_name
+                values = columns.get(field.attribute or field_name)
+                if values is None:
+                    if field.default is ma.missing:
+                        continue
+                    values = [field.default() if callable(field.default) else field.default] * count
+                    if not isinstance(field, Relationship):
+                        attributes.append((key, values))
+                        continue
+                if isinstance(field, Relationship):
+                    relationships.append((key, [{'data': value} for value in field.serialize_ids(values)]))
+                else:
+                    attributes.append((key, self._serialize_column(field, field_name, key, values, errors)))
+            if ids is None:
+                raise ValueError('The {0} column is missing'.format(id_attr))
+            data = self._build_columns(ids, attributes, relationships, errors)
+            if instrumentation is not None:
+                context.stats.time('dump.primary', timer() - started)
+                context.stats.count('dump.resources', count, self.Meta.type_)
+        if instrumentation is not None:
+            context.stats.report(instrumentation)
+        return ma.MarshalResult({'data': data, 'included': []}, errors)
+
+    def _serialize_column(self, field, field_name, key, values, errors):
+        """Serialise the ``values`` of a column with the ``field``. Unless the
+        field overrides ``serialize``, each value is passed directly to the
+        field's ``_serialize``. Values that fail to serialise are replaced with
+        ``missing`` and their errors are stored in ``errors`` by row index and
+        ``key``."""
+        direct = type(field).serialize is ma.fields.Field.serialize and field._CHECK_ATTRIBUTE
+        serialize = field._serialize if direct else field.serialize
+        result = []
+        for idx, value in enumerate(values):
+            try:
+                if direct:
+                    result.append(serialize(value, field_name, None))
+                else:
+                    result.append(serialize(field_name, value, accessor=_column_value))
+            except ma.ValidationError as err:
+                errors.setdefault(idx, {})[key] = err.messages
+                result.append(ma.missing)
         return result
+
+    def _build_columns(self, ids, attributes, relationships, errors):
+        """Build the JSONAPI resource objects from the serialised columns of
+        ``ids``, ``attributes``, and ``relationships``, one row at a time."""
+        type_ = self.Meta.type_
+        attribute_keys = tuple([key for key, _ in attributes])
+        relationship_keys = tuple([key for key, _ in relationships])
+        data = []
+        for idx, (id_, attribute_values, relationship_values) in enumerate(
+                zip(ids, zip(*[values for _, values in attributes]) if attributes else repeat(()),
+                    zip(*[values for _, values in relationships]) if relationships else repeat(()))):
+            resource = {'type': type_, 'id': str(id_)}
+            if attribute_keys:
+                resource['attributes'] = dict(zip(attribute_keys, attribute_values))
+                if idx in errors:
+                    for key in errors[idx]:
+                        resource['attributes'].pop(key, None)
+            if relationship_keys:
+                resource['relationships'] = dict(zip(relationship_keys, relationship_values))
+            data.append(resource)
+        return data
+
+    def _dump_primary(self, context, primary, obj, many):
+        """Serialise primary resources for :func:`~compound_jsonapi.schema.Schema.dump_iter`
+        and return them as a JSON fragment."""
+        with context:
+            node = self._node
+            for part in obj if many else [obj]:
+                key = context.visit_root(node, part)
+                primary.add(key)
+            context.prefetch([(node, part) for part in (obj if many else [obj])])
+            data, errors = super(Schema, self).dump(obj, many=many)
+            context.release(node, obj if many else [obj])
+        if errors:
+            raise ma.ValidationError(errors)
+        if many:
+            return ', '.join([self.opts.render_module.dumps(part) for part in data['data']])
+        else:
+            return self.opts.render_module.dumps(data['data'])
+
+    def _wrapper(self):
+        """Return the function that wraps a single serialised ``dict`` and the
+        id of its object into a JSONAPI resource object. The function is built
+        once per :class:`~compound_jsonapi.schema.Schema` and knows which keys
+        are relationships, so each resource object is built in a single pass."""
+        if self._wrap_resource is None:
+            type_ = self.Meta.type_
+            relationship_keys = frozenset([field.dump_to or field_name
+                                           for field_name, field, _ in self.relationship_fields()])
+            id_key = self._id_key('dump_to')
+
+            def wrap(data, id_):
+                attributes = None
+                relationships = None
+                for key, value in data.items():
+                    if key == id_key:
+                        continue
+                    elif key in relationship_keys:
+                        if relationships is None:
+                            relationships = {key: {'data': value}}
+                        else:
+                            relationships[key] = {'data': value}
+                    elif attributes is None:
+                        attributes = {key: value}
+                    else:
+                        attributes[key] = value
+                resource = {'type': type_, 'id': id_}
+                if attributes is not None:
+                    resource['attributes'] = attributes
+                if relationships is not None:
+                    resource['relationships'] = relationships
+                return resource
+            self._wrap_resource = wrap
+        return self._wrap_resource
+
+    @post_dump(pass_many=True, pass_original=True)
+    def _wrap(self, data, many, original):
+        """Wrap the response in the full JSONAPI structure. The ``included``
+        resources are added by :func:`~compound_jsonapi.schema.Schema.dump`."""
+        context = DumpContext.current()
+        if context is not None and context.stats is not None:
+            started = timer()
+            result = self._wrap_data(context, data, many, original)
+            context.stats.time('dump.wrap', timer() - started)
+            return result
+        return self._wrap_data(context, data, many, original)
+
+    def _wrap_data(self, context, data, many, original):
+        """Wrap the serialised ``data``. A ``list`` of serialised ``dict``\ s is
+        wrapped in place, so that each ``dict`` can be freed as soon as its
+        resource object has been built. The id of each resource object is taken
+        from the key that the ``context`` has cached for the ``original`` object,
+        so that it matches the id in the resource linkage."""
+        wrap = self._wrapper()
+        resource_id = self._resource_id
+        if many:
+            for idx, (part, obj) in enumerate(zip(data, original)):
+                data[idx] = wrap(part, resource_id(context, obj))
+            return {'data': data}
+        else:
+            return {'data': wrap(data, resource_id(context, original))}
+
+    def _resource_id(self, context, obj):
+        """Return the JSONAPI id of the ``obj``. Uses the key cached by the
+        ``context`` if there is one for this type, otherwise the id is
+        extracted from the ``obj``."""
+        if context is not None:
+            key = context.cached_key(obj)
+            if key is not None and key[0] == self.Meta.type_:
+                return key[1]
+        return self._identifier()(obj)
@@ -0,0 +1,62 @@
+"""
+:mod:`compound_jsonapi.stream`
+==============================
+
+Provides :func:`~compound_jsonapi.stream.iter_resources` for reading the
+resources of a compound JSONAPI document one at a time, which is used by
+:func:`~compound_jsonapi.schema.Schema.load_from`.
+
+If `ijson`_ is installed, the document is parsed incrementally, so that only a
+single resource is held in memory at any time. Otherwise the whole document is
+parsed with the standard library ``json`` module.
+
+.. _`ijson`: https://pypi.org/project/ijson/
+
+.. moduleauthor:: Mark Hall <mark.hall@work.room3b.eu>
+"""
+import json
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+_SECTIONS = {'data': 'data', 'data.item': 'data', 'included.item': 'included'}
+
+
+def iter_resources(fp):
+    """Read the resources of the compound JSONAPI document in the file-like
+    object ``fp``.
+
+    :return: Generator yielding ``(section, resource)`` tuples, where ``section``
+             is either ``'data'`` or ``'included'``
+    """
+    if ijson is None:
+        document = json.load(fp)
+        if isinstance(document.get('data'), list):
+            for resource in document['data']:
+                yield ('data', resource)
+        elif document.get('data') is not None:
+            yield ('data', document['data'])
+        for resource in document.get('included', []):
+            yield ('included', resource)
+        return
+    builder = None
+    depth = 0
+    section = None
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if builder is None:
+            if event == 'start_map' and prefix in _SECTIONS:
+                section = _SECTIONS[prefix]
+                builder = ijson.ObjectBuilder()
+                depth = 0
+            else:
+                continue
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth = depth + 1
+        elif event in ('end_map', 'end_array'):
+            depth = depth - 1
+            if depth == 0:
+                yield (section, builder.value)
+                builder = None
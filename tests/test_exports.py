@@ -167,3 +167,893 @@ def test_export_obj_empty_relationship(author_schema, tag_schema, author_obj):
     assert 'interests' in author['data']['relationships']
     assert 'data' in author['data']['relationships']['interests']
     assert author['data']['relationships']['interests']['data'] == []
+
+
+def test_included_unique(page_schema, comment_schema, author_schema, tag_schema, full_plain):
+    """Test that every included resource is only dumped once."""
+    page, errors = page_schema(include_schemas=(comment_schema, author_schema, tag_schema)).dump(full_plain)
+    assert errors == {}
+    keys = [(included['type'], included['id']) for included in page['included']]
+    assert len(keys) == len(set(keys))
+    assert ('pages', str(full_plain['id'])) not in keys
+
+
+def test_reuse_schema(page_schema, comment_schema, author_schema, tag_schema, full_plain):
+    """Test that dumping repeatedly with the same schema does not carry over any state."""
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    first, errors = schema.dump(full_plain)
+    assert errors == {}
+    second, errors = schema.dump(full_plain)
+    assert errors == {}
+    assert first == second
+
+
+def test_shared_schema_threads(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that a single schema can be shared between threads, with the errors
+    of invalid objects only reported for those objects."""
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    from conftest import full_plain
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    pages = [next(full_plain()) for _ in range(0, 40)]
+    for page in pages[1::2]:
+        page['author']['id'] = 'invalid'
+        page['author']['interests'][0]['id'] = 'invalid'
+    expected = [schema.dump(page) for page in pages]
+    assert [bool(errors) for _, errors in expected] == [False, True] * 20
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(schema.dump, pages * 5))
+    finally:
+        sys.setswitchinterval(interval)
+    assert results == expected * 5
+
+
+def test_compile(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that compiling resolves all relationships into a graph of schema nodes."""
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    node = schema.compile()
+    assert node.schema is schema
+    assert schema.compile() is node
+    relationships = dict((name, target) for name, _, target in node.relationships)
+    assert relationships['author'].type_ == 'authors'
+    assert relationships['comments'].type_ == 'comments'
+    assert isinstance(schema.fields['comments'].schema, comment_schema)
+    comment_relationships = dict((name, target) for name, _, target in relationships['comments'].relationships)
+    assert comment_relationships['author'] is relationships['author']
+    assert comment_relationships['page'].type_ == 'pages'
+
+
+def test_recursive_relationship():
+    """Test dumping a relationship that refers to its own schema."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class TreeSchema(Schema):
+        id = fields.Int()
+        children = Relationship(schema='self', many=True)
+
+        class Meta():
+            type_ = 'trees'
+
+    tree = {'id': 1, 'children': [{'id': 2, 'children': [{'id': 3, 'children': []}]}]}
+    data, errors = TreeSchema(include_schemas=(TreeSchema,)).dump(tree)
+    assert errors == {}
+    assert data['data']['relationships']['children']['data'] == [{'type': 'trees', 'id': '2'}]
+    assert len(data['included']) == 2
+
+
+def test_deep_relationship_chain():
+    """Test dumping a relationship chain that is deeper than the recursion limit."""
+    import sys
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class ChainSchema(Schema):
+        id = fields.Int()
+        next = Relationship(schema='self')
+
+        class Meta():
+            type_ = 'chains'
+
+    length = sys.getrecursionlimit() * 2
+    chain = {'id': 0, 'next': None}
+    head = chain
+    for idx in range(1, length):
+        head['next'] = {'id': idx, 'next': None}
+        head = head['next']
+    data, errors = ChainSchema(include_schemas=(ChainSchema,)).dump(chain)
+    assert errors == {}
+    assert data['data']['relationships']['next']['data'] == {'type': 'chains', 'id': '1'}
+    assert [included['id'] for included in data['included']] == [str(idx) for idx in range(1, length)]
+
+
+def test_included_errors():
+    """Test that errors in included resources are reported by type and id."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class ValueSchema(Schema):
+        id = fields.Int()
+        value = fields.Int()
+
+        class Meta():
+            type_ = 'values'
+
+    class ContainerSchema(Schema):
+        id = fields.Int()
+        values = Relationship(schema=ValueSchema, many=True)
+
+        class Meta():
+            type_ = 'containers'
+
+    data, errors = ContainerSchema(include_schemas=(ValueSchema,)).dump({'id': 1,
+                                                                          'values': [{'id': 2, 'value': 'a'}]})
+    assert errors == {'included': {'values': {'2': {'value': ['Not a valid integer.']}}}}
+    assert data['included'] == []
+    container = {'id': 1, 'values': [{'id': 2, 'value': 'a'}, {'id': 3, 'value': 5}]}
+    data, errors = ContainerSchema(include_schemas=(ValueSchema,)).dump(container)
+    assert errors == {'included': {'values': {'2': {'value': ['Not a valid integer.']}}}}
+    assert data['included'] == [{'type': 'values', 'id': '3', 'attributes': {'value': 5}}]
+
+
+def test_nested_independent_dump():
+    """Test that a dump from within a dump creates an independent document."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class EmbeddedTagSchema(Schema):
+        id = fields.Int()
+        tag = fields.Str()
+
+        class Meta():
+            type_ = 'tags'
+
+    class EmbeddedAuthorSchema(Schema):
+        id = fields.Int()
+        name = fields.Str()
+        interests = Relationship(schema=EmbeddedTagSchema, many=True)
+
+        class Meta():
+            type_ = 'authors'
+
+    class PostSchema(Schema):
+        id = fields.Int()
+        embedded = fields.Method('dump_author')
+
+        def dump_author(self, obj):
+            return EmbeddedAuthorSchema(include_schemas=(EmbeddedTagSchema,)).dump(obj['author']).data
+
+        class Meta():
+            type_ = 'posts'
+
+    author = {'id': 2, 'name': 'Name', 'interests': [{'id': 3, 'tag': 'tag'}]}
+    for compile_ in (False, True):
+        schema = PostSchema(include_schemas=(EmbeddedAuthorSchema, EmbeddedTagSchema))
+        if compile_:
+            schema.compile()
+        data, errors = schema.dump({'id': 1, 'author': author})
+        assert errors == {}
+        assert data['included'] == []
+        embedded = data['data']['attributes']['embedded']
+        assert embedded['data']['id'] == '2'
+        assert embedded['included'] == [{'type': 'tags', 'id': '3', 'attributes': {'tag': 'tag'}}]
+
+
+def test_included_batched_by_type():
+    """Test that the included resources are dumped in one batch per type."""
+    from marshmallow import fields, pre_dump
+    from compound_jsonapi import Schema, Relationship
+
+    batches = []
+
+    class CountingSchema(Schema):
+
+        @pre_dump(pass_many=True)
+        def count_batch(self, data, many):
+            batches.append((self.Meta.type_, len(data) if many else 1))
+
+    class BatchTagSchema(CountingSchema):
+        id = fields.Int()
+        tag = fields.Str()
+
+        class Meta():
+            type_ = 'tags'
+
+    class BatchAuthorSchema(CountingSchema):
+        id = fields.Int()
+        name = fields.Str()
+        interests = Relationship(schema=BatchTagSchema, many=True)
+
+        class Meta():
+            type_ = 'authors'
+
+    class BatchCommentSchema(CountingSchema):
+        id = fields.Int()
+        title = fields.Str()
+        author = Relationship(schema=BatchAuthorSchema)
+
+        class Meta():
+            type_ = 'comments'
+
+    class BatchPageSchema(CountingSchema):
+        id = fields.Int()
+        title = fields.Str()
+        author = Relationship(schema=BatchAuthorSchema)
+        comments = Relationship(schema=BatchCommentSchema, many=True)
+
+        class Meta():
+            type_ = 'pages'
+
+    def author(idx):
+        return {'id': idx, 'name': 'Author', 'interests': [{'id': idx * 3 + tag_idx, 'tag': 'Tag'}
+                                                           for tag_idx in range(0, 3)]}
+
+    page = {'id': 1,
+            'title': 'Page',
+            'author': author(0),
+            'comments': [{'id': idx, 'title': 'Comment', 'author': author(idx)} for idx in range(1, 4)]}
+    page, errors = BatchPageSchema(include_schemas=(BatchCommentSchema, BatchAuthorSchema,
+                                                    BatchTagSchema)).dump(page)
+    assert errors == {}
+    assert batches == [('pages', 1), ('comments', 3), ('authors', 4), ('tags', 12)]
+    assert len(page['included']) == 19
+
+
+def _sorted_included(document):
+    return sorted(document['included'], key=lambda resource: (resource['type'], resource['id']))
+
+
+def test_dump_iter(page_schema, comment_schema, author_schema, tag_schema, full_plain):
+    """Test that streaming a single object matches the normal dump."""
+    import json
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    expected, errors = schema.dump(full_plain)
+    streamed = json.loads(''.join(schema.dump_iter(full_plain)))
+    assert streamed['data'] == expected['data']
+    assert _sorted_included(streamed) == _sorted_included(expected)
+
+
+def test_dump_to_many(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that streaming a generator of objects in chunks matches the normal dump
+    and does not include primary resources that were first seen as related resources."""
+    import json
+    from io import StringIO
+
+    pages = [{'id': idx, 'title': 'Page', 'author': None, 'comments': []} for idx in range(0, 5)]
+    pages[0]['comments'].append({'id': 1, 'title': 'Comment', 'author': None, 'page': pages[3]})
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema), many=True)
+    expected, errors = schema.dump(pages)
+    fp = StringIO()
+    schema.dump_to((page for page in pages), fp, chunk_size=2)
+    streamed = json.loads(fp.getvalue())
+    assert streamed['data'] == expected['data']
+    assert _sorted_included(streamed) == _sorted_included(expected)
+    assert [(resource['type'], resource['id']) for resource in streamed['included']] == [('comments', '1')]
+
+
+def test_dump_iter_releases_objects(author_schema, tag_schema):
+    """Test that streaming a generator does not keep the primary objects that
+    have already been written alive."""
+    import gc
+    import weakref
+    from conftest import Obj
+
+    alive = weakref.WeakSet()
+    counts = []
+    tag = Obj(id=1, tag='Tag')
+
+    def authors():
+        for idx in range(0, 200):
+            author = Obj(id=idx, name='Author', interests=[tag])
+            alive.add(author)
+            yield author
+
+    schema = author_schema(include_schemas=(tag_schema,), many=True)
+    for _ in schema.dump_iter(authors(), chunk_size=10):
+        gc.collect()
+        counts.append(len(alive))
+    assert max(counts) <= 10
+    assert len(alive) == 0
+
+
+def test_dump_iter_errors():
+    """Test that errors while streaming are raised."""
+    import pytest
+    from marshmallow import fields, ValidationError
+    from compound_jsonapi import Schema
+
+    class ValueSchema(Schema):
+        id = fields.Int()
+        value = fields.Int()
+
+        class Meta():
+            type_ = 'values'
+
+    with pytest.raises(ValidationError):
+        list(ValueSchema(many=True).dump_iter([{'id': 1, 'value': 'a'}]))
+
+
+def test_shared_schema_instances(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that the included and related schemas are shared instances that are only
+    created when needed."""
+    from compound_jsonapi.pool import get_schema
+
+    first = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    second = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    assert 'tags' in first.include_schemas
+    assert 'pages' not in first.include_schemas
+    assert first.load_schemas['pages'] is first
+    assert first.load_schemas['tags'] is second.load_schemas['tags']
+    assert first.load_schemas['tags'] is get_schema(tag_schema)
+    assert first.fields['author'].schema is second.fields['author'].schema
+    assert get_schema(tag_schema, only=['tag']) is get_schema(tag_schema, only=['tag'])
+    assert get_schema(tag_schema, only=['tag']) is not get_schema(tag_schema)
+
+
+def test_export_dump_to_relationship(tag_schema):
+    """Test that relationships that are dumped to a different key are wrapped as relationships."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class WriterSchema(Schema):
+        id = fields.Int()
+        name = fields.Str(dump_to='full_name')
+        interests = Relationship(schema=tag_schema, many=True, dump_to='tags')
+
+        class Meta():
+            type_ = 'writers'
+
+    data, errors = WriterSchema(include_schemas=(tag_schema,)).dump({'id': 1, 'name': 'Writer',
+                                                                      'interests': [{'id': 2, 'tag': 'Tag'}]})
+    assert errors == {}
+    assert data['data'] == {'type': 'writers',
+                            'id': '1',
+                            'attributes': {'full_name': 'Writer'},
+                            'relationships': {'tags': {'data': [{'type': 'tags', 'id': '2'}]}}}
+
+
+def test_export_id_attr():
+    """Test that the id is read from the ``Meta.id_attr``."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class LabelSchema(Schema):
+        slug = fields.Str()
+        name = fields.Str()
+
+        class Meta():
+            type_ = 'labels'
+            id_attr = 'slug'
+
+    class PostSchema(Schema):
+        slug = fields.Str()
+        labels = Relationship(schema=LabelSchema, many=True)
+
+        class Meta():
+            type_ = 'posts'
+            id_attr = 'slug'
+
+    data, errors = PostSchema(include_schemas=(LabelSchema,)).dump({'slug': 'post', 'labels': [{'slug': 'a',
+                                                                                                'name': 'A'}]})
+    assert errors == {}
+    assert data['data'] == {'type': 'posts', 'id': 'post',
+                            'relationships': {'labels': {'data': [{'type': 'labels', 'id': 'a'}]}}}
+    assert data['included'] == [{'type': 'labels', 'id': 'a', 'attributes': {'name': 'A'}}]
+    loaded, errors = PostSchema(include_schemas=(LabelSchema,)).load(data)
+    assert errors == {}
+    assert loaded['slug'] == 'post'
+    assert loaded['labels'] == [{'slug': 'a', 'name': 'A'}]
+
+
+def test_export_id_getter_memoized():
+    """Test that the ``Meta.id_getter`` is called once per related object."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    calls = []
+
+    def get_id(obj):
+        calls.append(obj['key'])
+        return obj['key']
+
+    class PersonSchema(Schema):
+        key = fields.Int(dump_to='id')
+        name = fields.Str()
+
+        class Meta():
+            type_ = 'people'
+            id_getter = get_id
+            id_attr = 'key'
+
+    class NoteSchema(Schema):
+        id = fields.Int()
+        writer = Relationship(schema=PersonSchema)
+
+        class Meta():
+            type_ = 'notes'
+
+    writer = {'key': 1, 'name': 'Writer'}
+    notes = [{'id': idx, 'writer': writer} for idx in range(5)]
+    data, errors = NoteSchema(include_schemas=(PersonSchema,), many=True).dump(notes)
+    assert errors == {}
+    assert calls == [1]
+    assert [note['relationships']['writer']['data'] for note in data['data']] == [{'type': 'people', 'id': '1'}] * 5
+    assert data['included'] == [{'type': 'people', 'id': '1', 'attributes': {'name': 'Writer'}}]
+
+
+def test_export_id_getter_resource_id():
+    """Test that the resource objects use the id from the ``Meta.id_getter``."""
+    import json
+    import operator
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class DeviceSchema(Schema):
+        id = fields.Int()
+        name = fields.Str()
+
+        class Meta():
+            type_ = 'devices'
+            id_getter = operator.itemgetter('uuid')
+
+    class SensorSchema(Schema):
+        name = fields.Str()
+        device = Relationship(schema=DeviceSchema)
+
+        class Meta():
+            type_ = 'sensors'
+            id_getter = operator.itemgetter('uuid')
+
+    sensor = {'uuid': 'abc', 'name': 'Sensor', 'device': {'uuid': 'def', 'id': 1, 'name': 'Device'}}
+    data, errors = SensorSchema(include_schemas=(DeviceSchema,)).dump(sensor)
+    assert errors == {}
+    assert data['data'] == {'type': 'sensors', 'id': 'abc', 'attributes': {'name': 'Sensor'},
+                            'relationships': {'device': {'data': {'type': 'devices', 'id': 'def'}}}}
+    assert data['included'] == [{'type': 'devices', 'id': 'def', 'attributes': {'name': 'Device'}}]
+    assert json.loads(''.join(SensorSchema(include_schemas=(DeviceSchema,)).dump_iter([sensor], many=True))) == \
+        {'data': [data['data']], 'included': data['included']}
+
+
+def test_export_sparse_fieldsets(page_schema, comment_schema, author_schema, tag_schema, full_plain):
+    """Test that only the requested fields are serialised for each type."""
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema),
+                         fields={'pages': ['title', 'author'], 'authors': 'name'})
+    data, errors = schema.dump(full_plain)
+    assert errors == {}
+    assert set(data['data']['attributes']) == set(['title'])
+    assert set(data['data']['relationships']) == set(['author'])
+    assert data['data']['id'] == str(full_plain['id'])
+    assert len(data['included']) == 1
+    assert data['included'][0] == {'type': 'authors',
+                                   'id': str(full_plain['author']['id']),
+                                   'attributes': {'name': full_plain['author']['name']}}
+    data, errors = page_schema(include_schemas=(comment_schema, author_schema, tag_schema)).dump(full_plain)
+    assert errors == {}
+    assert 'comments' in data['data']['relationships']
+    assert 'interests' in [resource for resource in data['included']
+                           if resource['type'] == 'authors'][0]['relationships']
+
+
+def test_export_positional_options(author_schema, tag_schema, author_plain):
+    """Test that positional arguments after the included schemas are passed to marshmallow."""
+    data, errors = author_schema((tag_schema,), ('id', 'name')).dump(author_plain)
+    assert errors == {}
+    assert data['data']['attributes'] == {'name': author_plain['name']}
+    data, errors = author_schema((tag_schema,), ('id', 'name', 'interests'),
+                                 fields={'authors': 'interests'}).dump(author_plain)
+    assert errors == {}
+    assert 'attributes' not in data['data']
+
+
+def test_export_sparse_fieldsets_bounded(monkeypatch, page_schema, comment_schema, author_schema, tag_schema,
+                                         full_plain):
+    """Test that unknown types and field names do not create new shared schemas
+    and that the shared schemas and nodes are bounded."""
+    from compound_jsonapi import graph, pool
+
+    def dump(idx):
+        schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema),
+                             fields={'pages': 'title,author,bogus{0}'.format(idx),
+                                     'authors': 'name,bogus{0}'.format(idx),
+                                     'bogus{0}'.format(idx): 'name'})
+        return schema.dump(full_plain)
+
+    expected = dump(0)
+    instances, nodes = len(pool._instances), len(graph._class_nodes)
+    for idx in range(1, 50):
+        assert dump(idx) == expected
+    assert (len(pool._instances), len(graph._class_nodes)) == (instances, nodes)
+    monkeypatch.setattr(pool, 'max_size', 2)
+    for name in ['id', 'tag', 'id,tag']:
+        pool.get_schema(tag_schema, fields={'tags': name})
+    assert len(pool._instances) == 2
+    for name in ['title', 'text', 'title,text']:
+        page_schema(include_schemas=(comment_schema, author_schema, tag_schema),
+                    fields={'comments': name}).compile()
+    assert len(graph._class_nodes) == 2
+    pool.clear()
+    assert (len(pool._instances), len(graph._class_nodes)) == (0, 0)
+
+
+def _include_page():
+    """Build a page whose author has also written one of its comments."""
+    author = {'id': 1, 'name': 'Author', 'interests': [{'id': 1, 'tag': 'one'}]}
+    other = {'id': 2, 'name': 'Other', 'interests': [{'id': 2, 'tag': 'two'}]}
+    page = {'id': 1, 'title': 'Page', 'text': 'Text', 'author': author}
+    page['comments'] = [{'id': 1, 'title': 'First', 'text': 'Text', 'author': author, 'page': page},
+                        {'id': 2, 'title': 'Second', 'text': 'Text', 'author': other, 'page': page}]
+    return page
+
+
+def test_export_include_paths(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that only the resources on the include paths are included."""
+    include_schemas = (comment_schema, author_schema, tag_schema)
+    page = _include_page()
+    data, errors = page_schema(include_schemas=include_schemas, include='author').dump(page)
+    assert errors == {}
+    assert [(resource['type'], resource['id']) for resource in data['included']] == [('authors', '1')]
+    assert data['data']['relationships']['comments']['data'] == [{'type': 'comments', 'id': '1'},
+                                                                 {'type': 'comments', 'id': '2'}]
+    assert data['included'][0]['relationships']['interests']['data'] == [{'type': 'tags', 'id': '1'}]
+    data, errors = page_schema(include_schemas=include_schemas, include=['comments.author']).dump(page)
+    assert errors == {}
+    assert sorted([(resource['type'], resource['id']) for resource in data['included']]) == \
+        [('authors', '1'), ('authors', '2'), ('comments', '1'), ('comments', '2')]
+
+
+def test_export_include_paths_expand(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that a resource reached again via a longer include path is expanded."""
+    include_schemas = (comment_schema, author_schema, tag_schema)
+    data, errors = page_schema(include_schemas=include_schemas,
+                               include='author, comments.author.interests').dump(_include_page())
+    assert errors == {}
+    assert sorted([(resource['type'], resource['id']) for resource in data['included']]) == \
+        [('authors', '1'), ('authors', '2'), ('comments', '1'), ('comments', '2'), ('tags', '1'), ('tags', '2')]
+    data, errors = page_schema(include_schemas=include_schemas, include='').dump(_include_page())
+    assert errors == {}
+    assert data['included'] == []
+
+
+def test_dumps_bytes(page_schema, comment_schema, author_schema, tag_schema, full_plain):
+    """Test that dumping to bytes produces the same document with every backend."""
+    import json
+    from compound_jsonapi import encoding
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    expected, errors = schema.dump(full_plain)
+    assert errors == {}
+    try:
+        for backend in ['orjson', 'ujson', 'json']:
+            try:
+                encoding.use(backend)
+            except ValueError:
+                continue
+            data, errors = schema.dumps_bytes(full_plain)
+            assert errors == {}
+            assert isinstance(data, bytes)
+            assert json.loads(data.decode('utf-8')) == expected
+    finally:
+        encoding.use()
+
+
+def test_export_instrumentation(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that the timings and counters of a dump are reported."""
+    from compound_jsonapi.instrumentation import Recorder
+
+    recorder = Recorder()
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema), instrumentation=recorder)
+    data, errors = schema.dump(_include_page())
+    assert errors == {}
+    assert recorder.counts == {'dump.resources.pages': 1,
+                               'dump.resources.comments': 2,
+                               'dump.resources.authors': 2,
+                               'dump.resources.tags': 2,
+                               'dump.edges': 7,
+                               'dump.dedupe_hits': 1,
+                               'dump.included': 6}
+    assert set(recorder.timings) == set(['dump.primary', 'dump.included', 'dump.wrap'])
+    page_schema(include_schemas=(comment_schema, author_schema, tag_schema)).dump(_include_page())
+    assert recorder.counts['dump.included'] == 6
+
+
+def _versioned_schemas():
+    """Create schemas whose resources can be cached by version."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class VersionedTagSchema(Schema):
+        id = fields.Int()
+        tag = fields.Str()
+
+        class Meta():
+            type_ = 'tags'
+            version_attr = 'version'
+
+    class VersionedAuthorSchema(Schema):
+        id = fields.Int()
+        name = fields.Str()
+        interests = Relationship(schema=VersionedTagSchema, many=True)
+
+        class Meta():
+            type_ = 'authors'
+            version_attr = 'version'
+
+    class NoteSchema(Schema):
+        id = fields.Int()
+        author = Relationship(schema=VersionedAuthorSchema)
+
+        class Meta():
+            type_ = 'notes'
+
+    return NoteSchema, (VersionedAuthorSchema, VersionedTagSchema)
+
+
+def test_export_resource_cache():
+    """Test that cached included resources are re-used until their version changes."""
+    from compound_jsonapi.cache import MemoryCache, StoreCache, LocalStore
+    from compound_jsonapi.instrumentation import Recorder
+
+    note_schema, include_schemas = _versioned_schemas()
+    tags = [{'id': 1, 'tag': 'one', 'version': 1}, {'id': 2, 'tag': 'two', 'version': 1}]
+    author = {'id': 1, 'name': 'Author', 'interests': tags, 'version': 1}
+    expected, errors = note_schema(include_schemas=include_schemas).dump({'id': 1, 'author': author})
+    assert errors == {}
+    for cache in [MemoryCache(), StoreCache(LocalStore())]:
+        recorder = Recorder()
+        schema = note_schema(include_schemas=include_schemas, cache=cache, instrumentation=recorder)
+        assert schema.dump({'id': 1, 'author': author}) == (expected, {})
+        assert recorder.counts['dump.cache_misses.authors'] == 1
+        assert recorder.counts['dump.cache_misses.tags'] == 2
+        data, errors = schema.dump({'id': 2, 'author': author})
+        assert errors == {}
+        assert data['included'] == expected['included']
+        assert recorder.counts['dump.cache_hits.authors'] == 1
+        assert recorder.counts['dump.cache_hits.tags'] == 2
+        author['name'] = 'Renamed'
+        data, errors = schema.dump({'id': 3, 'author': author})
+        assert data['included'][0]['attributes']['name'] == 'Author'
+        author['version'] = 2
+        data, errors = schema.dump({'id': 3, 'author': author})
+        assert data['included'][0]['attributes']['name'] == 'Renamed'
+        assert recorder.counts['dump.cache_misses.authors'] == 2
+        author['name'] = 'Invalidated'
+        cache.invalidate('authors', 1)
+        data, errors = schema.dump({'id': 4, 'author': author})
+        assert data['included'][0]['attributes']['name'] == 'Invalidated'
+        assert recorder.counts['dump.cache_misses.authors'] == 3
+        author['name'] = 'Author'
+        author['version'] = 1
+
+
+def test_store_cache_invalidate():
+    """Test that resources invalidated while they are serialised are not cached."""
+    from compound_jsonapi.cache import StoreCache, LocalStore
+
+    cache = StoreCache(LocalStore())
+    key = ('tags', '1', '1', 'v')
+    assert cache.get_many([key]) == [None]
+    cache.invalidate('tags', '1')
+    cache.set_many([(key, {'id': '1'})])
+    assert cache.get_many([key]) == [None]
+    cache.set_many([(key, {'id': '1'})])
+    assert cache.get_many([key, ('tags', '2', '1', 'v')]) == [{'id': '1'}, None]
+
+
+def test_memory_cache_eviction():
+    """Test that the memory cache evicts by size, age, and resource."""
+    from compound_jsonapi.cache import MemoryCache
+
+    cache = MemoryCache(max_size=2)
+    cache.set_many([(('tags', '1', '1', 'v'), {'id': '1'}), (('tags', '2', '1', 'v'), {'id': '2'})])
+    assert cache.get_many([('tags', '1', '1', 'v')]) == [{'id': '1'}]
+    cache.set_many([(('tags', '3', '1', 'v'), {'id': '3'})])
+    assert len(cache) == 2
+    assert cache.get_many([('tags', '1', '1', 'v'), ('tags', '2', '1', 'v')]) == [{'id': '1'}, None]
+    cache.invalidate('tags', 1)
+    assert cache.get_many([('tags', '1', '1', 'v'), ('tags', '3', '1', 'v')]) == [None, {'id': '3'}]
+    cache = MemoryCache(ttl=-1)
+    cache.set_many([(('tags', '1', '1', 'v'), {'id': '1'})])
+    assert cache.get_many([('tags', '1', '1', 'v')]) == [None]
+    assert len(cache) == 0
+
+
+def test_dump_async(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that awaitable relationships are resolved level by level."""
+    import asyncio
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    expected, errors = schema.dump(_include_page())
+    assert errors == {}
+    levels = []
+
+    class AsyncObj(object):
+
+        def __init__(self, data, level):
+            self._data = data
+            self._level = level
+            for key, value in data.items():
+                if not isinstance(value, (dict, list)):
+                    setattr(self, key, value)
+
+        def __getattr__(self, name):
+            value = self._data[name]
+
+            async def load():
+                levels.append(self._level)
+                await asyncio.sleep(0)
+                if isinstance(value, list):
+                    return [AsyncObj(part, self._level + 1) for part in value]
+                return AsyncObj(value, self._level + 1)
+            return load()
+
+    loop = asyncio.new_event_loop()
+    try:
+        data, errors = loop.run_until_complete(schema.dump_async(AsyncObj(_include_page(), 0)))
+    finally:
+        loop.close()
+    assert errors == {}
+    assert data['data'] == expected['data']
+    assert _sorted_included(data) == _sorted_included(expected)
+    assert levels == sorted(levels)
+
+
+def test_dump_async_instrumentation(page_schema, comment_schema, author_schema, tag_schema):
+    """Test that the timings and counters of an asynchronous dump are reported as for dump."""
+    import asyncio
+    from compound_jsonapi.instrumentation import Recorder
+
+    expected = Recorder()
+    page_schema(include_schemas=(comment_schema, author_schema, tag_schema),
+                instrumentation=expected).dump(_include_page())
+    recorder = Recorder()
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema), instrumentation=recorder)
+    loop = asyncio.new_event_loop()
+    try:
+        data, errors = loop.run_until_complete(schema.dump_async(_include_page()))
+    finally:
+        loop.close()
+    assert errors == {}
+    assert recorder.counts == expected.counts
+    assert set(recorder.timings) == set(expected.timings)
+
+
+class _MemoryLoader(object):
+    """In-memory stand-in for a batch loader that records its calls."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.calls = []
+
+    def __call__(self, ids):
+        self.calls.append(sorted(ids))
+        return dict([(id_, self.objects[id_]) for id_ in ids if id_ in self.objects])
+
+
+def test_export_batch_loader():
+    """Test that the related objects are loaded with one call per loader and level."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    tag_loader = _MemoryLoader(dict([(idx, {'id': idx, 'tag': 'Tag {0}'.format(idx)}) for idx in range(0, 4)]))
+    writer_loader = _MemoryLoader(dict([(idx, {'id': idx, 'name': 'Writer {0}'.format(idx), 'tag_ids': [idx, idx + 1]})
+                                        for idx in range(0, 3)]))
+
+    class LoadedTagSchema(Schema):
+        id = fields.Int()
+        tag = fields.Str()
+
+        class Meta():
+            type_ = 'tags'
+
+    class LoadedWriterSchema(Schema):
+        id = fields.Int()
+        name = fields.Str()
+        interests = Relationship(schema=LoadedTagSchema, many=True, attribute='tag_ids', loader=tag_loader)
+
+        class Meta():
+            type_ = 'writers'
+
+    class LoadedNoteSchema(Schema):
+        id = fields.Int()
+        writer = Relationship(schema=LoadedWriterSchema, attribute='writer_id', loader=writer_loader)
+        reviewer = Relationship(schema=LoadedWriterSchema, attribute='reviewer_id', loader=writer_loader)
+
+        class Meta():
+            type_ = 'notes'
+
+    notes = [{'id': idx, 'writer_id': idx % 2, 'reviewer_id': 2 if idx == 0 else None} for idx in range(0, 5)]
+    data, errors = LoadedNoteSchema(include_schemas=(LoadedWriterSchema, LoadedTagSchema), many=True).dump(notes)
+    assert errors == {}
+    assert writer_loader.calls == [[0, 1, 2]]
+    assert tag_loader.calls == [[0, 1, 2, 3]]
+    assert data['data'][0]['relationships'] == {'writer': {'data': {'type': 'writers', 'id': '0'}},
+                                                'reviewer': {'data': {'type': 'writers', 'id': '2'}}}
+    assert data['data'][1]['relationships']['reviewer'] == {'data': None}
+    assert _sorted_included(data)[0] == {'type': 'tags', 'id': '0', 'attributes': {'tag': 'Tag 0'}}
+    assert [(resource['type'], resource['id']) for resource in _sorted_included(data)] == \
+        [('tags', '0'), ('tags', '1'), ('tags', '2'), ('tags', '3'),
+         ('writers', '0'), ('writers', '1'), ('writers', '2')]
+    writer = _sorted_included(data)[4]
+    assert writer['relationships']['interests']['data'] == [{'type': 'tags', 'id': '0'}, {'type': 'tags', 'id': '1'}]
+
+
+def test_export_columns(tag_schema, tags_plain):
+    """Test that dumping columns gives the same resources as dumping objects."""
+    columns = {'id': [tag['id'] for tag in tags_plain], 'tag': [tag['tag'] for tag in tags_plain]}
+    data, errors = tag_schema().dump_columns(columns)
+    assert errors == {}
+    assert data == tag_schema(many=True).dump(tags_plain).data
+    rows = [(tag['id'], tag['tag']) for tag in tags_plain]
+    assert tag_schema().dump_columns(rows, names=['id', 'tag']).data == data
+    assert tag_schema().dump_columns([], names=['id', 'tag']).data == {'data': [], 'included': []}
+    import pytest
+    with pytest.raises(ValueError):
+        tag_schema().dump_columns({'id': [1, 2], 'tag': ['Tag 1']})
+
+
+def test_export_columns_errors():
+    """Test that values that fail to serialise are reported by row."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema
+
+    class CountSchema(Schema):
+        id = fields.Int()
+        count = fields.Int()
+
+        class Meta():
+            type_ = 'counts'
+
+    data, errors = CountSchema().dump_columns({'id': [1, 2], 'count': [3, 'many']})
+    assert errors == {1: {'count': ['Not a valid integer.']}}
+    assert data['data'] == [{'type': 'counts', 'id': '1', 'attributes': {'count': 3}},
+                            {'type': 'counts', 'id': '2', 'attributes': {}}]
+
+
+def test_export_columns_relationships(comment_schema, page_schema, author_schema):
+    """Test that the linkage of relationships is dumped from the id columns."""
+    columns = {'id': [1, 2], 'title': ['Comment 1', 'Comment 2'], 'author': [3, None], 'page': [4, 4]}
+    data, errors = comment_schema(include_schemas=(author_schema, page_schema)).dump_columns(columns)
+    assert errors == {}
+    assert data['included'] == []
+    assert data['data'][0] == {'type': 'comments', 'id': '1',
+                               'attributes': {'title': 'Comment 1'},
+                               'relationships': {'author': {'data': {'type': 'authors', 'id': '3'}},
+                                                 'page': {'data': {'type': 'pages', 'id': '4'}}}}
+    assert data['data'][1]['relationships']['author'] == {'data': None}
+    data, errors = comment_schema(include_schemas=(author_schema,)).dump_columns(columns)
+    assert data['data'][0]['relationships']['page'] == {'data': None}
+
+
+def test_export_columns_relationship_default():
+    """Test that the default of a relationship without a column is dumped as linkage."""
+    from marshmallow import fields
+    from compound_jsonapi import Schema, Relationship
+
+    class OwnerSchema(Schema):
+        id = fields.Int()
+
+        class Meta():
+            type_ = 'owners'
+
+    class AssetSchema(Schema):
+        id = fields.Int()
+        owner = Relationship(schema=OwnerSchema, default=7)
+        holders = Relationship(schema=OwnerSchema, many=True, default=lambda: [8, 9])
+
+        class Meta():
+            type_ = 'assets'
+
+    data, errors = AssetSchema(include_schemas=(OwnerSchema,)).dump_columns({'id': [1, 2]})
+    assert errors == {}
+    assert data['data'][1] == {'type': 'assets', 'id': '2',
+                               'relationships': {'owner': {'data': {'type': 'owners', 'id': '7'}},
+                                                 'holders': {'data': [{'type': 'owners', 'id': '8'},
+                                                                      {'type': 'owners', 'id': '9'}]}}}
+    data, errors = AssetSchema().dump_columns({'id': [1]})
+    assert data['data'][0] == {'type': 'assets', 'id': '1',
+                               'relationships': {'owner': {'data': None}, 'holders': {'data': []}}}
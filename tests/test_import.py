@@ -81,3 +81,347 @@ def test_load_empty_list(author_schema, tag_schema, author_jsonapi):
     author, errors = author_schema(include_schemas=(tag_schema,)).load(author_jsonapi)
     assert errors == {}
     assert author.interests == []
+
+
+def _resources(document):
+    """Split a compound document into (section, resource) tuples."""
+    data = document['data'] if isinstance(document['data'], list) else [document['data']]
+    return [('data', resource) for resource in data] + \
+        [('included', resource) for resource in document.get('included', [])]
+
+
+def test_load_stream(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that loading a stream of resources resolves the circular relationships."""
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    page, errors = schema.load_stream(_resources(full_jsonapi))
+    assert errors == {}
+    assert page['title'] == full_jsonapi['data']['attributes']['title']
+    assert page['author'].name == full_jsonapi['included'][0]['attributes']['name']
+    assert len(page['author'].interests) == 3
+    assert len(page['comments']) == 3
+    for comment in page['comments']:
+        assert comment.page is page
+        assert len(comment.author.interests) == 3
+
+
+def test_load_stream_included_first(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that links to resources that arrive later are resolved."""
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    page, errors = schema.load_stream(reversed(_resources(full_jsonapi)))
+    assert errors == {}
+    assert len(page['comments']) == 3
+    for comment in page['comments']:
+        assert comment.page is page
+        assert len(comment.author.interests) == 3
+
+
+def test_load_stream_missing_links(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that links to resources that never arrive are left out."""
+    del author_with_interests_jsonapi['included'][1]
+    author, errors = author_schema(include_schemas=(tag_schema,)).load_stream(
+        _resources(author_with_interests_jsonapi))
+    assert errors == {}
+    assert [tag.tag for tag in author.interests] == [tag['attributes']['tag']
+                                                     for tag in author_with_interests_jsonapi['included']]
+
+
+def test_load_stream_included_errors(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that invalid included resources are reported as for load and are not linked."""
+    import copy
+
+    del author_with_interests_jsonapi['included'][0]['attributes']['tag']
+    invalid_id = author_with_interests_jsonapi['included'][0]['id']
+    schema = author_schema(include_schemas=(tag_schema,))
+    author, errors = schema.load_stream(_resources(author_with_interests_jsonapi))
+    assert errors == {'included': {'tags': {invalid_id: {'tag': ['Missing data for required field.']}}}}
+    loaded, load_errors = schema.load(copy.deepcopy(author_with_interests_jsonapi))
+    assert errors == load_errors
+    assert [tag.tag for tag in author.interests] == [tag['attributes']['tag']
+                                                     for tag in author_with_interests_jsonapi['included'][1:]]
+    assert [tag.tag for tag in loaded.interests] == [tag.tag for tag in author.interests]
+
+
+def test_load_missing_links(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that links to resources that are not included are left out."""
+    del author_with_interests_jsonapi['included'][1]
+    author, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi)
+    assert errors == {}
+    assert [tag.tag for tag in author.interests] == [tag['attributes']['tag']
+                                                     for tag in author_with_interests_jsonapi['included']]
+
+
+def test_load_missing_to_one_links(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that to-one links to resources that are not included are set to None or {}."""
+    import copy
+
+    full_jsonapi['included'] = [resource for resource in full_jsonapi['included'] if resource['type'] != 'authors']
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    for load in (lambda: schema.load(copy.deepcopy(full_jsonapi)),
+                 lambda: schema.load(copy.deepcopy(full_jsonapi), lazy=True),
+                 lambda: schema.load_stream(_resources(copy.deepcopy(full_jsonapi)))):
+        page, errors = load()
+        assert errors == {}
+        assert page['author'] == {}
+        assert len(page['comments']) == 3
+        for comment in page['comments']:
+            assert comment.author is None
+
+
+def test_load_stream_many(tag_schema, tags_jsonapi):
+    """Tests that loading a stream of many resources works."""
+    del tags_jsonapi['data'][1]['attributes']['tag']
+    tags, errors = tag_schema(many=True).load_stream(_resources(tags_jsonapi))
+    assert errors == {1: {'tag': ['Missing data for required field.']}}
+    assert len(tags) == 3
+
+
+def test_load_from(monkeypatch, page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that loading from a file works with and without an incremental parser."""
+    import json
+    from io import StringIO
+    from compound_jsonapi import stream
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    if stream.ijson is not None:
+        page, errors = schema.load_from(StringIO(json.dumps(full_jsonapi)))
+        assert errors == {}
+        assert len(page['comments']) == 3
+        assert page['comments'][0].page is page
+    monkeypatch.setattr(stream, 'ijson', None)
+    page, errors = schema.load_from(StringIO(json.dumps(full_jsonapi)))
+    assert errors == {}
+    assert len(page['comments']) == 3
+    assert page['comments'][0].page is page
+
+
+def test_relationship_fields(page_schema, tag_schema):
+    """Tests that the relationship fields are indexed once per schema."""
+    schema = page_schema()
+    fields = schema.relationship_fields()
+    assert sorted([(name, many) for name, _, many in fields]) == [('author', False), ('comments', True)]
+    assert schema.relationship_fields() is fields
+    assert tag_schema().relationship_fields() == ()
+
+
+def test_load_included_errors(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that errors in included resources are reported by type and id and that
+    the valid included resources are still loaded."""
+    invalid = author_with_interests_jsonapi['included'][1]
+    del invalid['attributes']['tag']
+    author, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi)
+    assert errors == {'included': {'tags': {invalid['id']: {'tag': ['Missing data for required field.']}}}}
+    assert len(author.interests) == 2
+    assert author.interests[0].tag == author_with_interests_jsonapi['included'][0]['attributes']['tag']
+    assert author.interests[1].tag == author_with_interests_jsonapi['included'][2]['attributes']['tag']
+
+
+def test_load_included_batched(author_schema, author_with_interests_jsonapi):
+    """Tests that the included resources are loaded in one batch per type."""
+    from marshmallow import fields, pre_load
+    from compound_jsonapi import Schema
+
+    batches = []
+
+    class BatchTagSchema(Schema):
+        id = fields.Int()
+        tag = fields.Str(required=True)
+
+        @pre_load(pass_many=True)
+        def count_batch(self, data, many):
+            batches.append(len(data) if many else 1)
+
+        class Meta():
+            type_ = 'tags'
+
+    author, errors = author_schema(include_schemas=(BatchTagSchema,)).load(author_with_interests_jsonapi)
+    assert errors == {}
+    assert batches == [3]
+    assert len(author.interests) == 3
+
+
+def test_load_thread_executor(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that loading the included resources on a thread pool works."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        page, errors = schema.load(full_jsonapi, executor=executor, chunk_size=2)
+    assert errors == {}
+    assert len(page['comments']) == 3
+    for comment in page['comments']:
+        assert comment.page is page
+        assert len(comment.author.interests) == 3
+
+
+def test_load_process_executor(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that loading the included resources on a process pool works and
+    reports errors by type and id."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    invalid = full_jsonapi['included'][1]
+    del invalid['attributes']['tag']
+    schema = page_schema(include_schemas=(comment_schema, author_schema, tag_schema))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        page, errors = schema.load(full_jsonapi, executor=executor, chunk_size=3)
+    assert errors == {'included': {'tags': {invalid['id']: {'tag': ['Missing data for required field.']}}}}
+    assert page['author'].name == full_jsonapi['included'][0]['attributes']['name']
+    for comment in page['comments']:
+        assert comment.page is page
+
+
+def test_loads_bytes(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that a document can be loaded from bytes and from a str."""
+    import json
+
+    schema = author_schema(include_schemas=(tag_schema,))
+    document = json.dumps(author_with_interests_jsonapi)
+    for json_data in [document.encode('utf-8'), document]:
+        author, errors = schema.loads_bytes(json_data)
+        assert errors == {}
+        assert author.name == author_with_interests_jsonapi['data']['attributes']['name']
+        assert len(author.interests) == 3
+
+
+def test_loads_render_module(tag_schema, tags_jsonapi):
+    """Tests that loads decodes the document with the schema's render_module."""
+    import json
+
+    calls = []
+
+    class RenderModule(object):
+
+        @staticmethod
+        def loads(json_data):
+            calls.append(json_data)
+            return json.loads(json_data)
+
+        dumps = staticmethod(json.dumps)
+
+    class RenderedTagSchema(tag_schema):
+
+        class Meta(tag_schema.Meta):
+            render_module = RenderModule
+
+    tags, errors = RenderedTagSchema(many=True).loads(json.dumps(tags_jsonapi))
+    assert errors == {}
+    assert len(tags) == 3
+    assert len(calls) == 1
+
+
+def test_load_instrumentation(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that the timings and counters of a load are reported."""
+    from compound_jsonapi.instrumentation import Recorder
+
+    recorder = Recorder()
+    author, errors = author_schema(include_schemas=(tag_schema,),
+                                   instrumentation=recorder).load(author_with_interests_jsonapi)
+    assert errors == {}
+    assert recorder.counts == {'load.resources.authors': 1, 'load.resources.tags': 3}
+    assert set(recorder.timings) == set(['load.primary', 'load.included', 'load.fixup'])
+
+
+def test_load_lazy(page_schema, comment_schema, author_schema, tag_schema, full_jsonapi):
+    """Tests that included resources are only deserialised when they are accessed."""
+    from compound_jsonapi.lazy import LazyResource, resolve
+
+    page, errors = page_schema(include_schemas=(comment_schema, author_schema, tag_schema)).load(full_jsonapi,
+                                                                                                 lazy=True)
+    assert errors == {}
+    assert isinstance(page['author'], LazyResource)
+    assert page['author'].resource_type == 'authors'
+    author_id = full_jsonapi['data']['relationships']['author']['data']['id']
+    assert page['author'].resource_id == author_id
+    assert ('authors', author_id) not in page['author']._document._loaded
+    author = [part for part in full_jsonapi['included'] if (part['type'], part['id']) == ('authors', author_id)]
+    assert page['author'].name == author[0]['attributes']['name']
+    assert ('authors', author_id) in page['author']._document._loaded
+    assert resolve(page['author']) is resolve(page['author'])
+    comment = resolve(page['comments'][0])
+    assert comment.page is page
+    assert resolve(comment.page['comments'][0]) is comment
+
+
+def test_load_lazy_errors(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that errors in lazily loaded resources are raised when they are accessed."""
+    import pytest
+    from marshmallow import ValidationError
+
+    del author_with_interests_jsonapi['included'][0]['attributes']['tag']
+    author, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi, lazy=True)
+    assert errors == {}
+    assert author.interests[1].tag == author_with_interests_jsonapi['included'][1]['attributes']['tag']
+    with pytest.raises(ValidationError):
+        author.interests[0].tag
+
+
+def test_load_identity_map(author_schema, tag_schema, author_with_interests_jsonapi):
+    """Tests that included resources are re-used from the identity map across loads."""
+    import copy
+    from compound_jsonapi.identity import IdentityMap
+    from compound_jsonapi.instrumentation import Recorder
+
+    identity_map = IdentityMap()
+    first, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi,
+                                                                       identity_map=identity_map)
+    assert errors == {}
+    assert len(identity_map) == 4
+    recorder = Recorder()
+    second, errors = author_schema(include_schemas=(tag_schema,),
+                                   instrumentation=recorder).load(copy.deepcopy(author_with_interests_jsonapi),
+                                                                  identity_map=identity_map)
+    assert errors == {}
+    assert second is not first
+    assert [tag is other for tag, other in zip(second.interests, first.interests)] == [True, True, True]
+    assert recorder.counts == {'load.resources.authors': 1, 'load.reused.tags': 3}
+    del author_with_interests_jsonapi['included']
+    third, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi,
+                                                                       identity_map=identity_map)
+    assert errors == {}
+    assert [tag is other for tag, other in zip(third.interests, first.interests)] == [True, True, True]
+    third, errors = author_schema(include_schemas=(tag_schema,)).load(author_with_interests_jsonapi)
+    assert third.interests == []
+
+
+def test_identity_map_eviction():
+    """Tests that the least recently used objects are evicted from the identity map."""
+    from compound_jsonapi.identity import IdentityMap
+
+    identity_map = IdentityMap(max_size=2)
+    identity_map.update([(('tags', '1'), 'Tag 1'), (('tags', '2'), 'Tag 2')])
+    assert identity_map.get(('tags', '1')) == 'Tag 1'
+    identity_map.update([(('tags', '3'), 'Tag 3')])
+    assert ('tags', '2') not in identity_map
+    assert identity_map.get(('tags', '1')) == 'Tag 1'
+    identity_map.invalidate('tags', 3)
+    assert identity_map.get(('tags', '3')) is None
+    assert len(identity_map) == 1
+
+
+def test_load_threads_errors(author_schema, tag_schema):
+    """Tests that concurrent loads with separate roots do not mix up their errors
+    through the shared included schemas."""
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    def document(idx, valid):
+        tags = [{'type': 'tags', 'id': str(tag_idx), 'attributes': {'tag': 'Tag'} if valid else {}}
+                for tag_idx in range(0, 5)]
+        return {'data': {'type': 'authors', 'id': str(idx), 'attributes': {'name': 'Author'},
+                         'relationships': {'interests': {'data': [{'type': 'tags', 'id': tag['id']}
+                                                                  for tag in tags]}}},
+                'included': tags}
+
+    def load(idx):
+        valid = idx % 2 == 0
+        return valid, author_schema(include_schemas=(tag_schema,)).load(document(idx, valid)).errors
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(load, range(0, 400)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert [errors == {} for valid, errors in results if valid] == [True] * 200
+    assert [sorted(errors['included']['tags']) for valid, errors in results if not valid] == \
+        [['0', '1', '2', '3', '4']] * 200